@@ -89,6 +89,24 @@ def dump_missing_leg_ids(state, detailed=False):
         missing_csv.writerow(item)
 
 
+def dump_fuzzy_matches(state):
+    """
+    For a given state, output the legislator names that were linked by
+    the fuzzy matcher (see BILLY_FUZZY_MATCH_THRESHOLD) to a CSV file,
+    least confident first, so they can be reviewed.
+    """
+    fuzzy_csv = csv.writer(open('%s_fuzzy_leg_ids.csv' % state, 'w'))
+    fuzzy_csv.writerow(('term', 'chamber', 'name', 'leg_id', 'matched_name',
+                        'score'))
+
+    for match in db.fuzzy_matches.find({'state': state}).sort('score'):
+        fuzzy_csv.writerow((match['term'], match['chamber'],
+                            match['name'].encode('ascii', 'replace'),
+                            match['leg_id'],
+                            match['form'].encode('ascii', 'replace'),
+                            '%.3f' % match['score']))
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description="dump a CSV of missing leg_id's",
@@ -102,3 +120,4 @@ if __name__ == '__main__':
 
     for state in args.states:
         dump_missing_leg_ids(state)
+        dump_fuzzy_matches(state)
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import sys
 import logging
 import argparse
 
@@ -10,6 +11,7 @@ from billy.importers.legislators import import_legislators
 from billy.importers.committees import import_committees
 from billy.importers.events import import_events
 from billy.importers.versions import import_versions
+from billy.importers.utils import lock_state, unlock_state, ImportLocked
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -22,7 +24,10 @@ if __name__ == '__main__':
                               'state to import'))
     parser.add_argument('-r', '--rpm', type=int, default=60,
                         help=('maximum number of documents to download '
-                              'per minute'))
+                              'per minute from a single host'))
+    parser.add_argument('--downloaders', type=int, default=4,
+                        help=('number of bill versions to download at '
+                              'once'))
     parser.add_argument('--bills', action='store_true',
                         help='scrape bill data')
     parser.add_argument('--legislators', action='store_true',
@@ -35,6 +40,8 @@ if __name__ == '__main__':
                         help='pull down copies of bill versions')
     parser.add_argument('--alldata', action='store_true', dest='alldata',
                         default=False, help="import all available data")
+    parser.add_argument('--workers', type=int, dest='workers', default=1,
+                        help="number of processes to import bills with")
 
     args = parser.parse_args()
 
@@ -60,18 +67,29 @@ if __name__ == '__main__':
                     format="%(asctime)s %(name)s %(levelname)s %(message)s",
                     datefmt="%H:%M:%S")
 
-    # always import metadata
-    import_metadata(args.state, data_dir)
+    # only one importer may work on a state at a time
+    try:
+        lock_state(args.state)
+    except ImportLocked as e:
+        print 'Error:', e
+        sys.exit(1)
 
-    if args.legislators or args.alldata:
-        import_legislators(args.state, data_dir)
-    if args.bills or args.alldata:
-        import_bills(args.state, data_dir)
-    if args.committees or args.alldata:
-        import_committees(args.state, data_dir)
+    try:
+        # always import metadata
+        import_metadata(args.state, data_dir)
 
-    # events and versions currently excluded from --alldata
-    if args.events:
-        import_events(args.state, data_dir)
-    if args.versions:
-        import_versions(args.state, args.rpm)
+        # legislators must be imported before anything that refers to them
+        if args.legislators or args.alldata:
+            import_legislators(args.state, data_dir)
+        if args.bills or args.alldata:
+            import_bills(args.state, data_dir, args.workers)
+        if args.committees or args.alldata:
+            import_committees(args.state, data_dir)
+
+        # events and versions currently excluded from --alldata
+        if args.events:
+            import_events(args.state, data_dir)
+        if args.versions:
+            import_versions(args.state, args.rpm, args.downloaders)
+    finally:
+        unlock_state(args.state)
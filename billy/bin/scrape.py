@@ -6,11 +6,14 @@ import os
 import sys
 import argparse
 import json
+import shutil
+import multiprocessing
 
 from billy.conf import settings, base_arg_parser
 from billy.scrape import (NoDataForPeriod, JSONDateEncoder,
                                 _scraper_registry)
 from billy.scrape.validator import DatetimeValidator
+from billy.scrape.cache import close_caches
 
 
 class RunException(Exception):
@@ -26,22 +29,22 @@ class RunException(Exception):
         else:
             return self.msg
 
-def _run_scraper(mod_path, state, scraper_type, options, metadata):
-    """
-        state: lower case two letter abbreviation of state
-        scraper_type: bills, legislators, committees, votes
-    """
-    # make or clear directory for this type
+def _clear_scraper_dir(options, scraper_type):
+    """ make or clear directory for this type """
     path = os.path.join(options.output_dir, scraper_type)
     try:
         os.makedirs(path)
     except OSError as e:
         if e.errno != 17:
             raise e
-        else:
+        elif not (options.incremental and scraper_type == 'bills'):
+            # incremental runs keep bills that won't be saved again
             for f in glob.glob(path+'/*.json'):
                 os.remove(f)
+    return path
 
+
+def _get_scraper_class(mod_path, state, scraper_type, options):
     try:
         mod_path = '%s.%s' % (mod_path, scraper_type)
         mod = __import__(mod_path)
@@ -50,18 +53,19 @@ def _run_scraper(mod_path, state, scraper_type, options, metadata):
             raise RunException("could not import %s" % mod_path, e)
 
     try:
-        ScraperClass = _scraper_registry[state][scraper_type]
+        return _scraper_registry[state][scraper_type]
     except KeyError as e:
         if not options.alldata:
             raise RunException("no %s %s scraper found" %
                                (state, scraper_type))
-        else:
-            return
 
+
+def _get_scraper_opts(options, scraper_type):
     opts = {'output_dir': options.output_dir,
             'no_cache': options.no_cache,
             'requests_per_minute': options.rpm,
             'strict_validation': options.strict,
+            'revalidate': options.revalidate,
             'retry_attempts': settings.SCRAPELIB_RETRY_ATTEMPTS,
             'retry_wait_seconds': settings.SCRAPELIB_RETRY_WAIT_SECONDS,
             # TODO: cache_dir, error_dir?
@@ -69,9 +73,13 @@ def _run_scraper(mod_path, state, scraper_type, options, metadata):
     if options.fastmode:
         opts['requests_per_minute'] = 0
         opts['use_cache_first'] = True
-    scraper = ScraperClass(metadata, **opts)
+    if options.incremental and scraper_type == 'bills':
+        opts['incremental_dir'] = options.output_dir
+    return opts
+
 
-    # times: the list to iterate over for second scrape param
+def _get_times(scraper, scraper_type, options, metadata):
+    """ the list to iterate over for second scrape param """
     if scraper_type in ('bills', 'votes', 'events'):
         if not options.sessions:
             if options.terms:
@@ -103,68 +111,192 @@ def _run_scraper(mod_path, state, scraper_type, options, metadata):
         for time in times:
             scraper.validate_term(time)
 
+    return times
+
+
+def _get_chambers(scraper_type, options):
+    chambers = list(options.chambers)
+    if scraper_type == 'events' and len(options.chambers) == 2:
+        chambers.append('other')
+    return chambers
+
+
+def _run_scraper(mod_path, state, scraper_type, options, metadata):
+    """
+        state: lower case two letter abbreviation of state
+        scraper_type: bills, legislators, committees, votes
+    """
+    _clear_scraper_dir(options, scraper_type)
+
+    ScraperClass = _get_scraper_class(mod_path, state, scraper_type, options)
+    if not ScraperClass:
+        return
+
+    scraper = ScraperClass(metadata,
+                           **_get_scraper_opts(options, scraper_type))
+    times = _get_times(scraper, scraper_type, options, metadata)
+
     # run scraper against year/session/term
     for time in times:
-        for chamber in options.chambers:
-            scraper.scrape(chamber, time)
-        if scraper_type == 'events' and len(options.chambers) == 2:
-            scraper.scrape('other', time)
+        for chamber in _get_chambers(scraper_type, options):
+            _scrape(scraper, scraper_type, chamber, time)
 
 
-def main():
+def _scrape(scraper, scraper_type, chamber, time):
+    started = datetime.datetime.utcnow()
+    scraper.scrape(chamber, time)
+    if scraper_type == 'bills':
+        scraper.save_watermark(chamber, time, started)
 
-    parser = argparse.ArgumentParser(
-        description='Scrape data for state, saving data to disk.',
-        parents=[base_arg_parser],
-    )
 
-    parser.add_argument('state', type=str,
-                        help='state scraper module (eg. nc)')
-    parser.add_argument('-s', '--session', action='append', dest='sessions',
-                        help='session(s) to scrape')
-    parser.add_argument('-t', '--term', action='append', dest='terms',
-                        help='term(s) to scrape')
-    parser.add_argument('--upper', action='store_true', dest='upper',
-                        default=False, help='scrape upper chamber')
-    parser.add_argument('--lower', action='store_true', dest='lower',
-                        default=False, help='scrape lower chamber')
-    parser.add_argument('--bills', action='store_true', dest='bills',
-                        default=False, help="scrape bill data")
-    parser.add_argument('--legislators', action='store_true',
-                        dest='legislators', default=False,
-                        help="scrape legislator data")
-    parser.add_argument('--committees', action='store_true', dest='committees',
-                        default=False, help="scrape committee data")
-    parser.add_argument('--votes', action='store_true', dest='votes',
-                        default=False, help="scrape vote data")
-    parser.add_argument('--events', action='store_true', dest='events',
-                        default=False, help='scrape event data')
-    parser.add_argument('--alldata', action='store_true', dest='alldata',
-                        default=False,
-                        help="scrape all available types of data")
-    parser.add_argument('--strict', action='store_true', dest='strict',
-                        default=False, help="fail immediately when"
-                        "encountering validation warning")
-    parser.add_argument('-n', '--no_cache', action='store_true',
-                        dest='no_cache', help="don't use web page cache")
-    parser.add_argument('--fastmode', help="scrape in fast mode",
-                        action="store_true", default=False)
-    parser.add_argument('-r', '--rpm', action='store', type=int, dest='rpm',
-                        default=60),
+def _get_scrape_units(mod_path, state, scraper_type, options, metadata):
+    """
+    Split a scraper run into (scraper_type, time, chamber) units that
+    can be scraped independently of one another.
+    """
+    ScraperClass = _get_scraper_class(mod_path, state, scraper_type, options)
+    if not ScraperClass:
+        return []
 
-    args = parser.parse_args()
+    scraper = ScraperClass(metadata,
+                           **_get_scraper_opts(options, scraper_type))
+    times = _get_times(scraper, scraper_type, options, metadata)
 
-    settings.update(args)
+    return [(scraper_type, time, chamber) for time in times
+            for chamber in _get_chambers(scraper_type, options)]
 
-    # set up search path
-    sys.path.insert(0, os.path.join(os.path.dirname(__file__),
-                                    '../../openstates'))
 
-    # get metadata
-    metadata = __import__(args.state, fromlist=['metadata']).metadata
-    state = metadata['abbreviation']
+def _run_scrape_unit(args):
+    """
+    Run a single scrape unit in a worker process, writing output to the
+    unit's own directory.
+    """
+    mod_path, state, unit, unit_dir, options, metadata = args
+    scraper_type, time, chamber = unit
 
-    # configure logger
+    ScraperClass = _get_scraper_class(mod_path, state, scraper_type, options)
+    os.makedirs(os.path.join(unit_dir, scraper_type))
+
+    opts = _get_scraper_opts(options, scraper_type)
+    opts['output_dir'] = unit_dir
+    scraper = ScraperClass(metadata, **opts)
+
+    start = datetime.datetime.now()
+    try:
+        _scrape(scraper, scraper_type, chamber, time)
+    finally:
+        # workers exit without running atexit handlers
+        close_caches()
+    return unit, datetime.datetime.now() - start
+
+
+def _merge_unit_output(unit_dir, output_dir, scraper_type):
+    """
+    Move a unit's JSON into the main output directory.
+
+    As in a serial run a later save of the same object replaces an
+    earlier one, except for votes, where each save is a distinct file.
+    """
+    dest_dir = os.path.join(output_dir, scraper_type)
+    for path in glob.glob(os.path.join(unit_dir, scraper_type, '*.json')):
+        base, ext = os.path.splitext(os.path.basename(path))
+        dest = os.path.join(dest_dir, base + ext)
+        if scraper_type == 'votes':
+            n = 0
+            while os.path.exists(dest):
+                n += 1
+                dest = os.path.join(dest_dir, '%s-%d%s' % (base, n, ext))
+        shutil.move(path, dest)
+
+
+def _run_scrapers_parallel(mod_path, state, scraper_types, options,
+                           metadata):
+    """
+    Run all (scraper_type, time, chamber) units for the given scraper
+    types across a pool of options.workers processes.
+
+    Each unit gets its own Scraper instance and output directory, the
+    resulting JSON is merged into options.output_dir once all units
+    have finished.
+    """
+    units = []
+    for scraper_type in scraper_types:
+        _clear_scraper_dir(options, scraper_type)
+        units.extend(_get_scrape_units(mod_path, state, scraper_type,
+                                       options, metadata))
+
+    work_dir = os.path.join(options.output_dir, '_workers')
+    shutil.rmtree(work_dir, ignore_errors=True)
+    unit_dirs = [os.path.join(work_dir, str(n)) for n in xrange(len(units))]
+
+    pool = multiprocessing.Pool(options.workers)
+    try:
+        for unit, elapsed in pool.imap_unordered(
+            _run_scrape_unit,
+            [(mod_path, state, unit, unit_dir, options, metadata)
+             for unit, unit_dir in zip(units, unit_dirs)]):
+            logging.getLogger('billy').info('finished %s %s %s in %s' %
+                                            (unit + (elapsed,)))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    # merge in unit order so the outcome matches a serial run
+    for unit, unit_dir in zip(units, unit_dirs):
+        _merge_unit_output(unit_dir, options.output_dir, unit[0])
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+scrape_arg_parser = argparse.ArgumentParser(add_help=False,
+                                            parents=[base_arg_parser])
+
+scrape_arg_parser.add_argument('-s', '--session', action='append',
+                               dest='sessions', help='session(s) to scrape')
+scrape_arg_parser.add_argument('-t', '--term', action='append', dest='terms',
+                               help='term(s) to scrape')
+scrape_arg_parser.add_argument('--upper', action='store_true', dest='upper',
+                               default=False, help='scrape upper chamber')
+scrape_arg_parser.add_argument('--lower', action='store_true', dest='lower',
+                               default=False, help='scrape lower chamber')
+scrape_arg_parser.add_argument('--bills', action='store_true', dest='bills',
+                               default=False, help="scrape bill data")
+scrape_arg_parser.add_argument('--legislators', action='store_true',
+                               dest='legislators', default=False,
+                               help="scrape legislator data")
+scrape_arg_parser.add_argument('--committees', action='store_true',
+                               dest='committees', default=False,
+                               help="scrape committee data")
+scrape_arg_parser.add_argument('--votes', action='store_true', dest='votes',
+                               default=False, help="scrape vote data")
+scrape_arg_parser.add_argument('--events', action='store_true', dest='events',
+                               default=False, help='scrape event data')
+scrape_arg_parser.add_argument('--alldata', action='store_true',
+                               dest='alldata', default=False,
+                               help="scrape all available types of data")
+scrape_arg_parser.add_argument('--strict', action='store_true', dest='strict',
+                               default=False, help="fail immediately when"
+                               "encountering validation warning")
+scrape_arg_parser.add_argument('-n', '--no_cache', action='store_true',
+                               dest='no_cache',
+                               help="don't use web page cache")
+scrape_arg_parser.add_argument('--fastmode', help="scrape in fast mode",
+                               action="store_true", default=False)
+scrape_arg_parser.add_argument('--revalidate', action='store_true',
+                               dest='revalidate', default=False,
+                               help="in fast mode, revalidate cached pages "
+                               "that have ETag/Last-Modified headers")
+scrape_arg_parser.add_argument('--incremental', action='store_true',
+                               dest='incremental', default=False,
+                               help="let bill scrapers skip bills that "
+                               "haven't changed since the last run")
+scrape_arg_parser.add_argument('-r', '--rpm', action='store', type=int,
+                               dest='rpm', default=60)
+
+
+def _configure_logging(args, prefix=''):
     if args.verbose == 0:
         verbosity = logging.WARNING
     elif args.verbose == 1:
@@ -173,13 +305,30 @@ def main():
         verbosity = logging.DEBUG
 
     logging.basicConfig(level=verbosity,
-                        format="%(asctime)s %(name)s %(levelname)s " + state +
-                               " %(message)s",
+                        format="%(asctime)s %(name)s %(levelname)s " + prefix +
+                               "%(message)s",
                         datefmt="%H:%M:%S",
                        )
 
+
+def _import_metadata(mod_path):
+    # set up search path
+    path = os.path.join(os.path.dirname(__file__), '../../openstates')
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+    return __import__(mod_path, fromlist=['metadata']).metadata
+
+
+def _prepare_state(mod_path, metadata, args):
+    """
+    Write the state's metadata and fill in output_dir, sessions and
+    chambers on args.
+
+    Returns the list of scraper types to run.
+    """
     # make output dir
-    args.output_dir = os.path.join(settings.BILLY_DATA_DIR, args.state)
+    args.output_dir = os.path.join(settings.BILLY_DATA_DIR, mod_path)
     try:
         os.makedirs(args.output_dir)
     except OSError as e:
@@ -229,16 +378,43 @@ def main():
         args.votes = True
         args.committees = True
 
-    if args.bills:
-        _run_scraper(args.state, state, 'bills', args, metadata)
-    if args.legislators:
-        _run_scraper(args.state, state, 'legislators', args, metadata)
-    if args.committees:
-        _run_scraper(args.state, state, 'committees', args, metadata)
-    if args.votes:
-        _run_scraper(args.state, state, 'votes', args, metadata)
-    if args.events:
-        _run_scraper(args.state, state, 'events', args, metadata)
+    return [scraper_type for scraper_type in
+            ('bills', 'legislators', 'committees', 'votes', 'events')
+            if getattr(args, scraper_type)]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Scrape data for state, saving data to disk.',
+        parents=[scrape_arg_parser],
+    )
+
+    parser.add_argument('state', type=str,
+                        help='state scraper module (eg. nc)')
+    parser.add_argument('--workers', type=int, dest='workers', default=1,
+                        help="number of processes to scrape sessions and "
+                        "chambers in parallel")
+
+    args = parser.parse_args()
+
+    settings.update(args)
+
+    # get metadata
+    metadata = _import_metadata(args.state)
+    state = metadata['abbreviation']
+
+    # configure logger
+    _configure_logging(args, state + ' ')
+
+    scraper_types = _prepare_state(args.state, metadata, args)
+
+    if args.workers > 1:
+        _run_scrapers_parallel(args.state, state, scraper_types, args,
+                               metadata)
+    else:
+        for scraper_type in scraper_types:
+            _run_scraper(args.state, state, scraper_type, args, metadata)
 
 
 if __name__ == '__main__':
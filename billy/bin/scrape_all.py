@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Scrape several states in one run, feeding every state's scrape units
+into a single scheduler with a global and a per-host concurrency limit.
+"""
+import os
+import sys
+import csv
+import copy
+import time
+import shutil
+import logging
+import datetime
+import argparse
+import traceback
+import multiprocessing
+from collections import defaultdict, deque
+
+from billy.conf import settings
+from billy.bin.scrape import (RunException, scrape_arg_parser,
+                              _configure_logging, _import_metadata,
+                              _prepare_state, _clear_scraper_dir,
+                              _get_scrape_units, _run_scrape_unit,
+                              _merge_unit_output)
+
+
+def _run_unit(args):
+    """ run a scrape unit, returning its elapsed time and any error """
+    start = datetime.datetime.now()
+    try:
+        _run_scrape_unit(args)
+        error = None
+    except BaseException:
+        # includes SystemExit, which must still be reported as a failure
+        error = traceback.format_exc()
+    return start, datetime.datetime.now() - start, error
+
+
+def _unit_process(args, conn):
+    conn.send(_run_unit(args))
+    conn.close()
+
+
+def run_units(units, workers, host_limit):
+    """
+    Run units in up to workers processes at once, never running more
+    than host_limit units against the same host at once.
+
+    units is a list of (host, args) pairs where args is suitable for
+    passing to _run_scrape_unit. Returns a list of (start, elapsed,
+    error) tuples in the same order as units.
+
+    Each unit is run in a process of its own, so a unit whose process
+    dies (eg. is killed for using too much memory) is recorded as
+    failed instead of being waited on forever.
+    """
+    results = [None] * len(units)
+    pending = deque(xrange(len(units)))
+    running = defaultdict(int)
+    in_flight = {}
+
+    try:
+        while pending or in_flight:
+            # start as many units as the limits allow, skipping over
+            # units whose host is already saturated
+            skipped = deque()
+            while pending and len(in_flight) < workers:
+                n = pending.popleft()
+                host = units[n][0]
+                if running[host] >= host_limit:
+                    skipped.append(n)
+                    continue
+                running[host] += 1
+                conn, child_conn = multiprocessing.Pipe(False)
+                process = multiprocessing.Process(
+                    target=_unit_process, args=(units[n][1], child_conn))
+                process.start()
+                # so that conn sees EOF if the process dies
+                child_conn.close()
+                in_flight[n] = (process, conn, datetime.datetime.now())
+            skipped.extend(pending)
+            pending = skipped
+
+            finished = [n for n, (process, conn, start) in
+                        in_flight.iteritems() if conn.poll()]
+            if not finished:
+                time.sleep(0.1)
+                continue
+
+            for n in finished:
+                process, conn, start = in_flight.pop(n)
+                try:
+                    results[n] = conn.recv()
+                except EOFError:
+                    process.join()
+                    results[n] = (start, datetime.datetime.now() - start,
+                                  'worker exited with code %s' %
+                                  process.exitcode)
+                conn.close()
+                process.join()
+                running[units[n][0]] -= 1
+    finally:
+        for process, conn, start in in_flight.itervalues():
+            process.terminate()
+            process.join()
+
+    return results
+
+
+def write_report(path, units, results):
+    with open(path, 'w') as f:
+        out = csv.writer(f)
+        out.writerow(['state', 'scraper_type', 'time', 'chamber', 'host',
+                      'start', 'seconds', 'status'])
+        for (host, args), (start, elapsed, error) in zip(units, results):
+            scraper_type, time, chamber = args[2]
+            seconds = elapsed.seconds + elapsed.microseconds / 1e6
+            seconds += elapsed.days * 86400
+            out.writerow([args[1], scraper_type, time, chamber, host,
+                          start.isoformat(), '%.2f' % seconds,
+                          'error' if error else 'ok'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Scrape data for several states, saving data to disk.',
+        parents=[scrape_arg_parser],
+    )
+
+    parser.add_argument('states', type=str, nargs='+',
+                        help='state scraper modules (eg. nc)')
+    parser.add_argument('--workers', type=int, dest='workers',
+                        default=multiprocessing.cpu_count(),
+                        help="maximum number of units to scrape at once")
+    parser.add_argument('--host_limit', type=int, dest='host_limit',
+                        default=1, help="maximum number of units to scrape "
+                        "at once against a single host")
+    parser.add_argument('--report', dest='report',
+                        help="where to write the per-unit timing report "
+                        "(default: <data_dir>/scrape_report.csv)")
+
+    args = parser.parse_args()
+
+    settings.update(args)
+
+    _configure_logging(args)
+    logger = logging.getLogger('billy')
+
+    # build every state's units before starting any so their processes
+    # inherit the already imported scraper modules
+    units = []
+    state_units = {}
+    for mod_path in args.states:
+        metadata = _import_metadata(mod_path)
+        state = metadata['abbreviation']
+        host = settings.BILLY_SCRAPE_HOSTS.get(state, state)
+
+        options = copy.deepcopy(args)
+        scraper_types = _prepare_state(mod_path, metadata, options)
+
+        work_dir = os.path.join(options.output_dir, '_workers')
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+        state_units[mod_path] = (options, work_dir, [])
+        for scraper_type in scraper_types:
+            _clear_scraper_dir(options, scraper_type)
+            for unit in _get_scrape_units(mod_path, state, scraper_type,
+                                          options, metadata):
+                unit_dir = os.path.join(work_dir, str(len(units)))
+                state_units[mod_path][2].append((unit, unit_dir))
+                units.append((host, (mod_path, state, unit, unit_dir,
+                                     options, metadata)))
+
+    results = run_units(units, args.workers, args.host_limit)
+
+    for (host, unit_args), (start, elapsed, error) in zip(units, results):
+        if error:
+            logger.error('%s %s %s %s failed:\n%s' %
+                         ((unit_args[1],) + unit_args[2] + (error,)))
+
+    # merge in unit order so the outcome matches a serial run
+    for mod_path in args.states:
+        options, work_dir, merge_units = state_units[mod_path]
+        for unit, unit_dir in merge_units:
+            if os.path.exists(unit_dir):
+                _merge_unit_output(unit_dir, options.output_dir, unit[0])
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = args.report or os.path.join(settings.BILLY_DATA_DIR,
+                                         'scrape_report.csv')
+    write_report(report, units, results)
+
+    if any(error for start, elapsed, error in results):
+        raise RunException('some units failed, see %s' % report)
+
+
+if __name__ == '__main__':
+    try:
+        result = main()
+    except RunException as e:
+        print 'Error:', e
+        sys.exit(1)
@@ -11,9 +11,23 @@ BILLY_DATA_DIR = os.path.abspath(os.path.join(os.path.abspath(
 BILLY_CACHE_DIR = os.path.abspath(os.path.join(os.path.abspath(
             os.path.dirname(__file__)), '../../cache'))
 
+# Store cached pages compressed and by content hash (see
+# billy.scrape.cache), optionally limiting total size (in bytes) and
+# the age (in seconds) of cached pages
+BILLY_CACHE_HASHED = True
+BILLY_CACHE_MAX_SIZE = None
+BILLY_CACHE_TTL = None
+
 BILLY_ERROR_DIR = os.path.abspath(os.path.join(os.path.abspath(
             os.path.dirname(__file__)), '../../errors'))
 
+# Text extracted from documents (see billy.extract) is cached here by
+# content hash, extraction runs in BILLY_EXTRACT_WORKERS processes
+# (None for one per CPU)
+BILLY_EXTRACT_CACHE_DIR = os.path.abspath(os.path.join(os.path.abspath(
+            os.path.dirname(__file__)), '../../extract_cache'))
+BILLY_EXTRACT_WORKERS = None
+
 BILLY_SUBJECTS = ['Agriculture and Food',
                  'Animal Rights and Wildlife Issues',
                  'Arts and Humanities',
@@ -62,3 +76,13 @@ BILLY_SUBJECTS = ['Agriculture and Food',
 SCRAPELIB_TIMEOUT = 600
 SCRAPELIB_RETRY_ATTEMPTS = 3
 SCRAPELIB_RETRY_WAIT_SECONDS = 20
+
+# Hosts shared by several states' scrapers, used by scrape_all.py to limit
+# how many units run against one server at once, eg. {'nc': 'ncga', ...}.
+# States not listed here are assumed to have a host of their own.
+BILLY_SCRAPE_HOSTS = {}
+
+# Minimum Jaro-Winkler similarity (0-1) for the importers to link an
+# otherwise unmatched legislator name to its closest known form, eg. 0.9.
+# Fuzzy matching is disabled if this is None.
+BILLY_FUZZY_MATCH_THRESHOLD = None
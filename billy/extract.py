@@ -0,0 +1,190 @@
+"""
+Text extraction for documents such as bill versions and vote PDFs,
+shared by scrapers and the search indexer.
+
+Extracted text is cached by the content hash of the document, so a
+document is only ever extracted once no matter who asks for it.
+"""
+import os
+import zlib
+import hashlib
+import logging
+import tempfile
+import itertools
+import subprocess
+import multiprocessing
+from collections import deque
+
+import lxml.html
+
+from billy.conf import settings
+
+_log = logging.getLogger('billy')
+
+
+def _kind(content_type):
+    """ map a content type to the extraction method used for it """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type == 'application/pdf':
+        return 'pdf'
+    elif content_type in ('text/html', 'application/xhtml+xml'):
+        return 'html'
+    elif content_type.startswith('text/'):
+        return 'text'
+    return None
+
+
+def extract_text(data, content_type):
+    """
+    Extract the text of a document, returning None for content types
+    that aren't supported. PDFs are converted with pdftotext, which must
+    be on the path.
+    """
+    kind = _kind(content_type)
+
+    if kind == 'pdf':
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            f.write(data)
+            f.flush()
+            proc = subprocess.Popen(['pdftotext', '-enc', 'UTF-8', '-layout',
+                                     f.name, '-'], stdout=subprocess.PIPE)
+            text = proc.communicate()[0]
+        if proc.returncode:
+            raise Exception("pdftotext exited with %s" % proc.returncode)
+        return text.decode('utf8', 'replace')
+    elif kind == 'html':
+        return lxml.html.fromstring(data).text_content()
+    elif kind == 'text':
+        return data.decode('utf8', 'replace')
+
+    return None
+
+
+def _extract_task(task):
+    """ run in a worker: extract a document unless its text was cached """
+    key, data, content_type, text = task
+    if text is not None or data is None:
+        return text, False
+    try:
+        return extract_text(data, content_type), True
+    except Exception as e:
+        _log.error("Failed to extract text from %s document %s: %s" %
+                   (content_type, key, e))
+        return None, False
+
+
+class TextExtractor(object):
+    """
+    Extracts text from documents, caching the results in cache_dir by
+    content hash. Many documents can be extracted at once in a pool of
+    workers processes with :meth:`extract_many`.
+    """
+
+    def __init__(self, cache_dir, workers=None):
+        """
+        :param cache_dir: directory to cache extracted text in
+        :param workers: number of processes to extract with, defaults to
+            the number of CPUs (0 extracts in this process)
+        """
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self._pool = None
+
+    def _key(self, data, content_type):
+        return '%s-%s' % (hashlib.sha1(data).hexdigest(), _kind(content_type))
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key[2:])
+
+    def get_cached(self, data, content_type):
+        """ get the cached text of a document or None """
+        return self._get(self._key(data, content_type))
+
+    def _get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return zlib.decompress(f.read()).decode('utf8')
+        except (IOError, zlib.error):
+            return None
+
+    def _set(self, key, text):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != 17:
+                raise e
+
+        # write to a temp file first so readers never see partial text
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(zlib.compress(text.encode('utf8')))
+        os.rename(tmp_path, path)
+
+    def _map(self, func, tasks):
+        # pool workers (eg. parallel scrapes) can't start pools of their
+        # own, they extract in process instead
+        if self.workers == 0 or multiprocessing.current_process().daemon:
+            return itertools.imap(func, tasks)
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers)
+        return self._pool.imap(func, tasks)
+
+    def extract(self, data, content_type):
+        """
+        Get the text of a document, extracting it in this process if it
+        isn't cached. Returns None if it can't be extracted.
+        """
+        key = self._key(data, content_type)
+        text = self._get(key)
+        if text is not None:
+            return text
+
+        text, extracted = _extract_task((key, data, content_type, None))
+        if extracted and text is not None:
+            self._set(key, text)
+        return text
+
+    def extract_many(self, documents):
+        """
+        Extract the text of many documents in parallel.
+
+        documents is an iterable of (obj, data, content_type) tuples where
+        obj is anything identifying the document. Yields (obj, text) for
+        each document in the same order.
+        """
+        objs = deque()
+
+        def tasks():
+            for obj, data, content_type in documents:
+                key = self._key(data, content_type)
+                text = self._get(key)
+                objs.append((obj, key))
+                # cached documents don't need to be sent to a worker
+                yield (key, data if text is None else None, content_type,
+                       text)
+
+        for text, extracted in self._map(_extract_task, tasks()):
+            obj, key = objs.popleft()
+            if extracted and text is not None:
+                self._set(key, text)
+            yield obj, text
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+_extractor = None
+
+
+def get_extractor():
+    """ get the shared TextExtractor configured by the settings """
+    global _extractor
+    if _extractor is None:
+        _extractor = TextExtractor(settings.BILLY_EXTRACT_CACHE_DIR,
+                                   getattr(settings, 'BILLY_EXTRACT_WORKERS',
+                                           None))
+    return _extractor
@@ -4,21 +4,32 @@ import re
 import sys
 import time
 import glob
+import hashlib
 import datetime
+import multiprocessing
 from collections import defaultdict
 import json
 
 from billy.utils import keywordize
-from billy import db
-from billy.importers.names import get_legislator_id
-from billy.importers.utils import (insert_with_id,
+from billy import db, fs
+from billy.conf import settings
+from billy.importers.names import get_legislator_ids, get_name_digest
+from billy.importers.utils import (assign_id,
                                    update, prepare_obj,
                                    get_committee_id,
+                                   get_committee_digest,
                                    fix_bill_id,
-                                   VoteMatcher,)
+                                   VoteMatcher, chunks, release_ids)
 
 import pymongo
 
+# number of bill files loaded and looked up in the database at once
+BILL_CHUNK_SIZE = 500
+
+# bump this whenever import_bill changes what it stores for a bill, so
+# that bills imported before the change aren't skipped as unchanged
+FINGERPRINT_VERSION = '1'
+
 
 def ensure_indexes():
     db.bills.ensure_index([('state', pymongo.ASCENDING),
@@ -48,26 +59,46 @@ def ensure_indexes():
                            ('chamber', pymongo.ASCENDING),
                            ('sponsors', pymongo.ASCENDING)])
 
-def import_votes(state, data_dir):
+def index_votes(state, data_dir):
+    """
+    Map (bill_chamber, session, bill_id) to the paths of the vote files
+    for that bill, without keeping the votes themselves in memory.
+    """
     pattern = os.path.join(data_dir, 'votes', '*.json')
-    paths = glob.glob(pattern)
 
     votes = defaultdict(list)
+    count = 0
 
-    for path in paths:
+    for path in glob.iglob(pattern):
         with open(path) as f:
-            data = prepare_obj(json.load(f))
+            data = json.load(f)
 
         # need to match bill_id already in the database
-        bill_id = fix_bill_id(data.pop('bill_id'))
+        bill_id = fix_bill_id(data['bill_id'])
 
-        votes[(data['bill_chamber'], data['session'], bill_id)].append(data)
+        votes[(data['bill_chamber'], data['session'], bill_id)].append(path)
+        count += 1
 
-    print 'imported %s vote files' % len(paths)
+    print 'indexed %s vote files' % count
     return votes
 
 
-def import_bills(state, data_dir):
+def load_votes(paths):
+    """ load the vote files for a single bill """
+    votes = []
+    for path in paths:
+        with open(path) as f:
+            data = prepare_obj(json.load(f))
+        del data['bill_id']
+        votes.append(data)
+    return votes
+
+
+def import_bills(state, data_dir, workers=1):
+    """
+    Import a state's scraped bills. If workers is more than one the bill
+    files are split into chunks imported by a pool of processes.
+    """
     data_dir = os.path.join(data_dir, state)
     pattern = os.path.join(data_dir, 'bills', '*.json')
 
@@ -79,94 +110,229 @@ def import_bills(state, data_dir):
         for session in term['sessions']:
             sessions[session] = term['name']
 
-    votes = import_votes(state, data_dir)
+    votes = index_votes(state, data_dir)
+
+    if workers > 1:
+        # workers are forked after this is set so they inherit the
+        # vote index instead of being sent it with every chunk
+        _worker_args.update(state=state, votes=votes, sessions=sessions)
+        pool = multiprocessing.Pool(workers, initializer=_init_worker)
+        try:
+            results = pool.imap_unordered(
+                _import_bill_paths_worker,
+                chunks(glob.iglob(pattern), BILL_CHUNK_SIZE))
+            count = skipped = 0
+            for chunk_count, chunk_skipped, keys in results:
+                count += chunk_count
+                skipped += chunk_skipped
+                for key in keys:
+                    votes.pop(key, None)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _worker_args.clear()
+    else:
+        count = skipped = 0
+        for paths in chunks(glob.iglob(pattern), BILL_CHUNK_SIZE):
+            chunk_count, chunk_skipped, keys = import_bill_paths(
+                state, paths, votes, sessions)
+            count += chunk_count
+            skipped += chunk_skipped
+
+    print 'imported %s bill files (%s unchanged)' % (count, skipped)
+
+    for remaining in votes.keys():
+        print 'Failed to match vote %s %s %s' % tuple([
+            r.encode('ascii', 'replace') for r in remaining])
+
+    populate_current_fields(state)
+    ensure_indexes()
+
+
+_worker_args = {}
+
+
+def _init_worker():
+    # connections can't be shared with the parent process
+    db._db = None
+    fs._fs = None
+
+
+def _import_bill_paths_worker(paths):
+    try:
+        return import_bill_paths(paths=paths, **_worker_args)
+    finally:
+        # pool workers exit without running atexit handlers
+        release_ids()
+
 
-    paths = glob.glob(pattern)
+def import_bill_paths(state, paths, votes, sessions):
+    """
+    Import a chunk of bill files, popping their votes from votes.
 
+    Returns the number of bills, how many of them were unchanged and the
+    (chamber, session, bill_id) keys of all of them.
+    """
+    bills = []
     for path in paths:
         with open(path) as f:
-            data = prepare_obj(json.load(f))
+            raw = f.read()
+        data = json.loads(raw)
 
         # clean up bill_id
         data['bill_id'] = fix_bill_id(data['bill_id'])
+        data['_content_hash'] = bill_fingerprint(
+            raw, votes.get((data['chamber'], data['session'],
+                            data['bill_id']), []),
+            get_name_digest(state, data['session']),
+            get_committee_digest(state))
+        bills.append(data)
 
-        # move subjects to scraped_subjects
-        subjects = data.pop('subjects', None)
-        if subjects:
-            data['scraped_subjects'] = subjects
-
-        # add loaded votes to data
-        bill_votes = votes.pop((data['chamber'], data['session'],
-                                data['bill_id']), [])
-        data['votes'].extend(bill_votes)
-
-        bill = db.bills.find_one({'state': data['state'],
-                                  'session': data['session'],
-                                  'chamber': data['chamber'],
-                                  'bill_id': data['bill_id']})
-
-        vote_matcher = VoteMatcher(data['state'])
-        if bill:
-            vote_matcher.learn_vote_ids(bill['votes'])
-        vote_matcher.set_vote_ids(data['votes'])
-
-        # match sponsor leg_ids
-        for sponsor in data['sponsors']:
-            id = get_legislator_id(state, data['session'], None,
-                                   sponsor['name'])
-            sponsor['leg_id'] = id
-
-        for vote in data['votes']:
-
-            # committee_ids
-            if 'committee' in vote:
-                committee_id = get_committee_id(state,
-                                                vote['chamber'],
-                                                vote['committee'])
-                vote['committee_id'] = committee_id
-
-            # vote leg_ids
-            for vtype in ('yes_votes', 'no_votes', 'other_votes'):
-                svlist = []
-                for svote in vote[vtype]:
-                    id = get_legislator_id(state, data['session'],
-                                           vote['chamber'], svote)
-                    svlist.append({'name': svote, 'leg_id': id})
-
-                vote[vtype] = svlist
-
-        data['_term'] = sessions[data['session']]
-
-        # Merge any version titles into the alternate_titles list
-        alt_titles = set(data.get('alternate_titles', []))
-        for version in data['versions']:
-            if 'title' in version:
-                alt_titles.add(version['title'])
-            if '+short_title' in version:
-                alt_titles.add(version['+short_title'])
-        try:
-            # Make sure the primary title isn't included in the
-            # alternate title list
-            alt_titles.remove(data['title'])
-        except KeyError:
-            pass
-        data['alternate_titles'] = list(alt_titles)
-
-        if not bill:
-            data['_keywords'] = list(bill_keywords(data))
-            insert_with_id(data)
-        else:
-            data['_keywords'] = list(bill_keywords(data))
-            update(bill, data, db.bills)
-
-    print 'imported %s bill files' % len(paths)
+    existing = get_existing_bills(state, bills)
 
-    for remaining in votes.keys():
-        print 'Failed to match vote %s %s %s' % tuple([
-            r.encode('ascii', 'replace') for r in remaining])
+    skipped = 0
+    keys = []
+    new = {}
+    for data in bills:
+        keys.append((data['chamber'], data['session'], data['bill_id']))
+        key = (data['session'], data['chamber'], data['bill_id'])
+        # a duplicate of a new bill earlier in this chunk is merged into it
+        bill = existing.get(key) or new.get(key)
 
-    populate_current_fields(state)
-    ensure_indexes()
+        if bill and bill.get('_content_hash') == data['_content_hash']:
+            votes.pop(keys[-1], None)
+            skipped += 1
+            continue
+
+        data = import_bill(state, prepare_obj(data), bill, votes, sessions,
+                           saved=key not in new)
+        if data:
+            new[key] = data
+
+    if new:
+        db.bills.insert(new.values(), safe=True)
+
+    return len(bills), skipped, keys
+
+
+def bill_fingerprint(raw, vote_paths, name_digest, committee_digest):
+    """
+    Hash everything a bill's import depends on: the scraped JSON, its
+    vote files, the names its sponsors and voters are matched against
+    and the committees its votes are matched against. If it is unchanged
+    the bill doesn't need to be imported.
+    """
+    fingerprint = hashlib.sha1(FINGERPRINT_VERSION)
+    fingerprint.update(raw)
+    for path in sorted(vote_paths):
+        with open(path) as f:
+            fingerprint.update(f.read())
+    fingerprint.update(name_digest or '')
+    fingerprint.update(committee_digest or '')
+    fingerprint.update(repr(getattr(settings, 'BILLY_FUZZY_MATCH_THRESHOLD',
+                                    None)))
+    return fingerprint.hexdigest()
+
+
+def get_existing_bills(state, bills):
+    """
+    Fetch the stored versions of a chunk of scraped bills with a single
+    query, returning a dict keyed on (session, chamber, bill_id).
+    """
+    sessions = list(set(data['session'] for data in bills))
+    bill_ids = list(set(data['bill_id'] for data in bills))
+
+    existing = {}
+    for bill in db.bills.find({'state': state,
+                               'session': {'$in': sessions},
+                               'bill_id': {'$in': bill_ids}}):
+        existing[(bill['session'], bill['chamber'], bill['bill_id'])] = bill
+    return existing
+
+
+def import_bill(state, data, bill, votes, sessions, saved=True):
+    """
+    Import a single scraped bill, bill is the already stored version of
+    it or None if it is new. If saved is False bill hasn't been inserted
+    yet and is only updated in memory.
+
+    New bills are given an _id and returned rather than inserted, so
+    that they can be inserted together.
+    """
+    # move subjects to scraped_subjects
+    subjects = data.pop('subjects', None)
+    if subjects:
+        data['scraped_subjects'] = subjects
+
+    # add this bill's votes to data
+    bill_votes = load_votes(votes.pop((data['chamber'], data['session'],
+                                       data['bill_id']), []))
+    data['votes'].extend(bill_votes)
+
+    vote_matcher = VoteMatcher(data['state'])
+    if bill:
+        vote_matcher.learn_vote_ids(bill['votes'])
+    vote_matcher.set_vote_ids(data['votes'])
+
+    # match sponsor leg_ids
+    sponsor_ids = get_legislator_ids(state, data['session'], None,
+                                     [s['name'] for s in data['sponsors']])
+    for sponsor, id in zip(data['sponsors'], sponsor_ids):
+        sponsor['leg_id'] = id
+
+    # gather every voter's name by chamber so that each chamber's voters
+    # are resolved in a single call
+    voters = defaultdict(set)
+    for vote in data['votes']:
+        for vtype in ('yes_votes', 'no_votes', 'other_votes'):
+            voters[vote['chamber']].update(vote[vtype])
+    voter_ids = {}
+    for chamber, names in voters.iteritems():
+        names = list(names)
+        ids = get_legislator_ids(state, data['session'], chamber, names)
+        voter_ids[chamber] = dict(zip(names, ids))
+
+    for vote in data['votes']:
+
+        # committee_ids
+        if 'committee' in vote:
+            committee_id = get_committee_id(state,
+                                            vote['chamber'],
+                                            vote['committee'])
+            vote['committee_id'] = committee_id
+
+        # vote leg_ids
+        ids = voter_ids.get(vote['chamber'], {})
+        for vtype in ('yes_votes', 'no_votes', 'other_votes'):
+            vote[vtype] = [{'name': svote, 'leg_id': ids[svote]}
+                           for svote in vote[vtype]]
+
+    data['_term'] = sessions[data['session']]
+
+    # Merge any version titles into the alternate_titles list
+    alt_titles = set(data.get('alternate_titles', []))
+    for version in data['versions']:
+        if 'title' in version:
+            alt_titles.add(version['title'])
+        if '+short_title' in version:
+            alt_titles.add(version['+short_title'])
+    try:
+        # Make sure the primary title isn't included in the
+        # alternate title list
+        alt_titles.remove(data['title'])
+    except KeyError:
+        pass
+    data['alternate_titles'] = list(alt_titles)
+
+    data['_keywords'] = list(bill_keywords(data))
+    if not bill:
+        assign_id(data)
+        return data
+    else:
+        update(bill, data, db.bills if saved else None)
 
 
 def bill_keywords(bill):
@@ -183,20 +349,18 @@ def populate_current_fields(state):
     """
     Set/update _current_term and _current_session fields on all bills
     from the given state.
+
+    Only bills whose flags actually change are written.
     """
     meta = db.metadata.find_one({'_id': state})
     current_term = meta['terms'][-1]
     current_session = current_term['sessions'][-1]
 
-    for bill in db.bills.find({'state': state}):
-        if bill['session'] == current_session:
-            bill['_current_session'] = True
-        else:
-            bill['_current_session'] = False
-
-        if bill['session'] in current_term['sessions']:
-            bill['_current_term'] = True
-        else:
-            bill['_current_term'] = False
-
-        db.bills.save(bill, safe=True)
+    for field, sessions in (('_current_session', [current_session]),
+                            ('_current_term', current_term['sessions'])):
+        db.bills.update({'state': state, 'session': {'$in': sessions},
+                         field: {'$ne': True}},
+                        {'$set': {field: True}}, multi=True, safe=True)
+        db.bills.update({'state': state, 'session': {'$nin': sessions},
+                         field: {'$ne': False}},
+                        {'$set': {field: False}}, multi=True, safe=True)
@@ -6,7 +6,7 @@ import datetime
 import json
 
 from billy import db
-from billy.importers.names import get_legislator_id
+from billy.importers.names import get_legislator_ids
 from billy.importers.utils import prepare_obj, update, insert_with_id
 
 import pymongo
@@ -19,6 +19,38 @@ def ensure_indexes():
                                 ('subcommittee', pymongo.ASCENDING)])
 
 
+class CommitteeIndex(object):
+    """
+    In-memory lookups of a state's committees, standing in for
+    db.committees.find_one queries during an import.
+    """
+
+    def __init__(self, committees):
+        self._by_name = {}
+        self._by_committee = {}
+        for committee in committees:
+            self.add(committee)
+
+    def add(self, committee):
+        # like find_one, the first matching committee wins
+        self._by_name.setdefault((committee['chamber'],
+                                  committee['committee'],
+                                  committee.get('subcommittee')), committee)
+        self._by_committee.setdefault((committee['chamber'],
+                                       committee['committee']), committee)
+
+    def find(self, chamber, committee, subcommittee=None, any_sub=False):
+        """
+        Find a committee, if any_sub is True any committee with a
+        matching name will do but one that isn't a subcommittee is
+        preferred.
+        """
+        found = self._by_name.get((chamber, committee, subcommittee))
+        if found is None and any_sub:
+            found = self._by_committee.get((chamber, committee))
+        return found
+
+
 def import_committees(state, data_dir):
     data_dir = os.path.join(data_dir, state)
     pattern = os.path.join(data_dir, 'committees', '*.json')
@@ -29,36 +61,42 @@ def import_committees(state, data_dir):
 
     paths = glob.glob(pattern)
 
-    for committee in db.committees.find({'state': state}):
-        committee['members'] = []
-        db.committees.save(committee)
+    db.committees.update({'state': state}, {'$set': {'members': []}},
+                         multi=True, safe=True)
+    committees = CommitteeIndex(db.committees.find({'state': state}))
+
+    # changed documents are saved once at the end, keyed on _id
+    changed_committees = {}
+    changed_legislators = {}
+
+    legislators = {}
+    for legislator in db.legislators.find({
+        'roles': {'$elemMatch': {'term': current_term, 'state': state}}}):
+        legislators[legislator['_id']] = legislator
 
     if not paths:
         # Not standalone committees
-        for legislator in db.legislators.find({
-            'roles': {'$elemMatch': {'term': current_term,
-                                     'state': state}}}):
+        for legislator in legislators.itervalues():
 
             for role in legislator['roles']:
                 if (role['type'] == 'committee member' and
                     'committee_id' not in role):
 
-                    spec = {'state': role['state'],
-                            'chamber': role['chamber'],
-                            'committee': role['committee']}
-                    if 'subcommittee' in role:
-                        spec['subcommittee'] = role['subcommittee']
-
-                    committee = db.committees.find_one(spec)
+                    committee = committees.find(
+                        role['chamber'], role['committee'],
+                        role.get('subcommittee'),
+                        any_sub='subcommittee' not in role)
 
                     if not committee:
-                        committee = spec
-                        committee['_type'] = 'committee'
-                        committee['members'] = []
-                        committee['sources'] = []
-                        if 'subcommittee' not in committee:
-                            committee['subcommittee'] = None
+                        committee = {'state': role['state'],
+                                     'chamber': role['chamber'],
+                                     'committee': role['committee'],
+                                     'subcommittee': role.get('subcommittee'),
+                                     '_type': 'committee',
+                                     'members': [],
+                                     'sources': []}
                         insert_with_id(committee)
+                        committees.add(committee)
 
                     for member in committee['members']:
                         if member['leg_id'] == legislator['leg_id']:
@@ -68,52 +106,53 @@ def import_committees(state, data_dir):
                             {'name': legislator['full_name'],
                              'leg_id': legislator['leg_id'],
                              'role': role.get('position') or 'member'})
-                        db.committees.save(committee, safe=True)
+                        changed_committees[committee['_id']] = committee
 
                         role['committee_id'] = committee['_id']
-
-            db.legislators.save(legislator, safe=True)
+                        changed_legislators[legislator['_id']] = legislator
 
     for path in paths:
         with open(path) as f:
             data = prepare_obj(json.load(f))
 
-        spec = {'state': state,
-                'chamber': data['chamber'],
-                'committee': data['committee']}
-        if 'subcommittee' in data:
-            spec['subcommittee'] = data['subcommittee']
-
-        committee = db.committees.find_one(spec)
+        committee = committees.find(data['chamber'], data['committee'],
+                                    data.get('subcommittee'),
+                                    any_sub='subcommittee' not in data)
 
         if not committee:
             insert_with_id(data)
             committee = data
+            committees.add(committee)
         else:
-            update(committee, data, db.committees)
-
-        for member in committee['members']:
-            if not member['name']:
-                continue
+            update(committee, data, None)
+        changed_committees[committee['_id']] = committee
 
-            leg_id = get_legislator_id(state, current_session,
-                                       data['chamber'],
-                                       member['name'])
+        members = [member for member in committee['members']
+                   if member['name']]
+        leg_ids = get_legislator_ids(state, current_session,
+                                     data['chamber'],
+                                     [member['name'] for member in members])
 
+        for member, leg_id in zip(members, leg_ids):
             if not leg_id:
                 print "No matches for %s" % member['name'].encode(
                     'ascii', 'ignore')
                 member['leg_id'] = None
                 continue
 
-            legislator = db.legislators.find_one({'_id': leg_id})
-
             member['leg_id'] = leg_id
 
+            try:
+                legislator = legislators[leg_id]
+            except KeyError:
+                # matched through a role that has since moved to old_roles
+                legislator = db.legislators.find_one({'_id': leg_id})
+                legislators[leg_id] = legislator
+
             for role in legislator['roles']:
                 if (role['type'] == 'committee member' and
                     role['term'] == current_term and
-                    role['committee_id'] == committee['_id']):
+                    role.get('committee_id') == committee['_id']):
                     break
             else:
                 new_role = {'type': 'committee member',
@@ -126,9 +165,16 @@ def import_committees(state, data_dir):
                     new_role['subcommittee'] = committee['subcommittee']
                 legislator['roles'].append(new_role)
                 legislator['updated_at'] = datetime.datetime.utcnow()
-                db.legislators.save(legislator, safe=True)
+                changed_legislators[legislator['_id']] = legislator
 
+    for committee in changed_committees.itervalues():
         db.committees.save(committee, safe=True)
+    for legislator in changed_legislators.itervalues():
+        db.legislators.update({'_id': legislator['_id']},
+                              {'$set': {'roles': legislator['roles'],
+                                        'updated_at':
+                                        legislator.get('updated_at')}},
+                              safe=True)
 
     print 'imported %s committee files' % len(paths)
 
@@ -138,18 +184,25 @@ def import_committees(state, data_dir):
 
 
 def link_parents(state):
-    for comm in db.committees.find({'state': state}):
+    committees = list(db.committees.find({'state': state},
+                                         fields=['chamber', 'committee',
+                                                 'subcommittee',
+                                                 'parent_id']))
+    index = CommitteeIndex(committees)
+
+    for comm in committees:
         sub = comm.get('subcommittee')
         if not sub:
-            comm['parent_id'] = None
+            parent_id = None
         else:
-            parent = db.committees.find_one({'state': state,
-                                             'chamber': comm['chamber'],
-                                             'committee': comm['committee']})
+            parent = index.find(comm['chamber'], comm['committee'],
+                                any_sub=True)
             if not parent:
                 print "Failed finding parent for: %s" % sub
-                comm['parent_id'] = None
+                parent_id = None
             else:
-                comm['parent_id'] = parent['_id']
+                parent_id = parent['_id']
 
-        db.committees.save(comm)
+        if 'parent_id' not in comm or comm['parent_id'] != parent_id:
+            db.committees.update({'_id': comm['_id']},
+                                 {'$set': {'parent_id': parent_id}})
@@ -8,11 +8,11 @@ import json
 
 from billy import db
 from billy.importers.names import get_legislator_id
-from billy.importers.utils import prepare_obj, update, get_committee_id
+from billy.importers.utils import (prepare_obj, update, get_committee_id,
+                                   get_allocator, chunks)
 from billy.scrape.events import Event
 
 import pymongo
-from pymongo.son import SON
 
 
 def ensure_indexes():
@@ -24,50 +24,98 @@ def ensure_indexes():
                             ('type', pymongo.ASCENDING)])
 
 
-def _insert_with_id(event):
-    query = SON([('_id', event['state'])])
-    update = SON([('$inc', SON([('seq', 1)]))])
-    seq = db.command(SON([('findandmodify', 'event_ids'),
-                          ('query', query),
-                          ('update', update),
-                          ('new', True),
-                          ('upsert', True)]))['value']['seq']
+# number of event files handled with one batch of queries and inserts
+EVENT_CHUNK_SIZE = 500
+
+
+def _assign_id(event):
+    seq = get_allocator('event_ids', event['state']).next()
 
     id = "%sE%08d" % (event['state'].upper(), seq)
     logging.info("Saving as %s" % id)
 
     event['_id'] = id
-    db.events.save(event, safe=True)
+    return id
 
+
+def _insert_with_id(event):
+    id = _assign_id(event)
+    db.events.save(event, safe=True)
     return id
 
 
+def _event_key(event):
+    return (event['when'], event.get('end'), event['type'],
+            event['description'])
+
+
+class EventIndex(object):
+    """
+    The _ids of a state's events by _guid and by (when, end, type,
+    description), so scraped events can be matched without a query
+    per event.
+    """
+
+    def __init__(self, state):
+        self._guids = {}
+        self._keys = {}
+        for event in db.events.find({'state': state},
+                                    fields=['_guid', 'when', 'end', 'type',
+                                            'description']):
+            self.add(event)
+
+    def add(self, event):
+        if '_guid' in event:
+            self._guids.setdefault(event['_guid'], event['_id'])
+        self._keys.setdefault(_event_key(event), event['_id'])
+
+    def find(self, event):
+        id = None
+        if '_guid' in event:
+            id = self._guids.get(event['_guid'])
+        if not id:
+            id = self._keys.get(_event_key(event))
+        return id
+
+
 def import_events(state, data_dir, import_actions=True):
     data_dir = os.path.join(data_dir, state)
     pattern = os.path.join(data_dir, 'events', '*.json')
 
-    for path in glob.iglob(pattern):
-        with open(path) as f:
-            data = prepare_obj(json.load(f))
-
-        event = None
-        if '_guid' in data:
-            event = db.events.find_one({'state': data['state'],
-                                        '_guid': data['_guid']})
-
-        if not event:
-            event = db.events.find_one({'state': data['state'],
-                                        'when': data['when'],
-                                        'end': data['end'],
-                                        'type': data['type'],
-                                        'description': data['description']})
-
-        if not event:
-            data['created_at'] = datetime.datetime.utcnow()
-            data['updated_at'] = data['created_at']
-            _insert_with_id(data)
-        else:
-            update(event, data, db.events)
+    index = EventIndex(state)
+
+    for paths in chunks(glob.iglob(pattern), EVENT_CHUNK_SIZE):
+        events = []
+        for path in paths:
+            with open(path) as f:
+                events.append(prepare_obj(json.load(f)))
+
+        # fetch all of the chunk's already stored events at once
+        ids = [index.find(data) for data in events]
+        existing = dict((event['_id'], event) for event in
+                        db.events.find({'_id': {'$in': filter(None, ids)}}))
+
+        new = {}
+        changed = {}
+        for data in events:
+            id = index.find(data)
+
+            if id in new:
+                # a duplicate of an event earlier in this chunk
+                update(new[id], data, None)
+            elif id in existing:
+                if update(existing[id], data, None):
+                    changed[id] = existing[id]
+            else:
+                data['created_at'] = datetime.datetime.utcnow()
+                data['updated_at'] = data['created_at']
+                new[_assign_id(data)] = data
+                index.add(data)
+
+        if new:
+            db.events.insert(new.values(), safe=True)
+        for event in changed.itervalues():
+            db.events.save(event, safe=True)
 
 #    if import_actions:
 #        actions_to_events(state)
@@ -7,6 +7,7 @@ import json
 
 from billy import db
 from billy.importers.utils import insert_with_id, update, prepare_obj
+from billy.importers.names import build_name_indexes
 
 import pymongo
 import name_tools
@@ -30,9 +31,10 @@ def import_legislators(state, data_dir):
     data_dir = os.path.join(data_dir, state)
     pattern = os.path.join(data_dir, 'legislators', '*.json')
     paths = glob.glob(pattern)
+    adjacent_terms = get_adjacent_terms(state)
     for path in paths:
         with open(path) as f:
-            import_legislator(json.load(f))
+            import_legislator(json.load(f), adjacent_terms)
 
     print 'imported %s legislator files' % len(paths)
 
@@ -44,28 +46,38 @@ def import_legislators(state, data_dir):
 
     ensure_indexes()
 
+    # build the name indexes now so bill/committee imports can load them
+    build_name_indexes(state)
+
 
 def activate_legislators(state, current_term):
     """
     Sets the 'active' flag on legislators and populates top-level
     district/chamber/party fields for currently serving legislators.
-    """
-    meta = db.metadata.find_one({'_id': state})
 
+    Only legislators whose fields change are written.
+    """
     for legislator in db.legislators.find({'roles': {'$elemMatch':
                                                      {'state': state,
                                                       'type': 'member',
-                                                      'term': current_term}}}):
+                                                      'term': current_term}}},
+                                          fields=['roles', 'active', 'party',
+                                                  'district', 'chamber']):
         active_role = legislator['roles'][0]
 
-        if not active_role['end_date']:
-            legislator['active'] = True
-            legislator['party'] = active_role['party']
-            legislator['district'] = active_role['district']
-            legislator['chamber'] = active_role['chamber']
+        if active_role['end_date']:
+            continue
+
+        fields = {'active': True,
+                  'party': active_role['party'],
+                  'district': active_role['district'],
+                  'chamber': active_role['chamber']}
+        if all(legislator.get(k) == v for k, v in fields.iteritems()):
+            continue
 
-        legislator['updated_at'] = datetime.datetime.utcnow()
-        db.legislators.save(legislator, safe=True)
+        fields['updated_at'] = datetime.datetime.utcnow()
+        db.legislators.update({'_id': legislator['_id']}, {'$set': fields},
+                              safe=True)
 
 
 def deactivate_legislators(state, current_term):
@@ -84,21 +96,30 @@ def deactivate_legislators(state, current_term):
                         'end_date': {'$ne':None}}}
             }
 
-        ]}):
-
-        if 'old_roles' not in leg:
-            leg['old_roles'] = {}
+        ]}, fields=['roles']):
 
-        leg['old_roles'][leg['roles'][0]['term']] = leg['roles']
-        leg['roles'] = []
-        leg['active'] = False
+        # move the roles to old_roles and clear the current fields in
+        # place rather than re-saving the whole document
+        db.legislators.update(
+            {'_id': leg['_id']},
+            {'$set': {'old_roles.%s' % leg['roles'][0]['term']: leg['roles'],
+                      'roles': [],
+                      'active': False,
+                      'updated_at': datetime.datetime.utcnow()},
+             '$unset': {'district': 1, 'chamber': 1, 'party': 1}},
+            safe=True)
 
-        for key in ('district', 'chamber', 'party'):
-            if key in leg:
-                del leg[key]
 
-        leg['updated_at'] = datetime.datetime.utcnow()
-        db.legislators.save(leg, safe=True)
+def get_adjacent_terms(state):
+    """
+    Map each of a state's terms to its (previous, next) terms, either
+    of which may be None.
+    """
+    terms = [term['name'] for term in
+             db.metadata.find_one({'_id': state})['terms']]
+    prev_terms = [None] + terms[:-1]
+    next_terms = terms[1:] + [None]
+    return dict(zip(terms, zip(prev_terms, next_terms)))
 
 
 def get_previous_term(state, term):
@@ -123,7 +144,12 @@ def get_next_term(state, term):
     return None
 
 
-def import_legislator(data):
+def import_legislator(data, adjacent_terms=None):
+    """
+    Import a scraped legislator. adjacent_terms is the output of
+    get_adjacent_terms, pass it when importing many legislators to
+    avoid looking the terms up for each one.
+    """
     data = prepare_obj(data)
     data['_scraped_name'] = data['full_name']
 
@@ -135,8 +161,9 @@ def import_legislator(data):
 
     cur_role = data['roles'][0]
     term = cur_role['term']
-    prev_term = get_previous_term(data['state'], term)
-    next_term = get_next_term(data['state'], term)
+    if adjacent_terms is None:
+        adjacent_terms = get_adjacent_terms(data['state'])
+    prev_term, next_term = adjacent_terms.get(term, (None, None))
 
     spec = {'state': data['state'],
             'type': cur_role['type'],
@@ -1,15 +1,93 @@
 import re
 import csv
+import json
 import os.path
+import hashlib
+import logging
+import datetime
+from collections import defaultdict
 
 from billy import db
+from billy.conf import settings
+
+import jellyfish
+
+_log = logging.getLogger('billy')
 
 __matchers = {}
 
 
-def get_legislator_id(state, session, chamber, name):
+def _manual_path(state):
+    return os.path.join(os.path.dirname(__file__),
+                        "../../manual_data/leg_ids/%s.csv" % state)
+
+
+def _manual_mtime(state):
+    try:
+        return os.path.getmtime(_manual_path(state))
+    except OSError:
+        return None
+
+
+def _index_id(state, term):
+    return '%s-%s' % (state, term)
+
+
+def build_name_index(state, term):
+    """
+    Build the NameMatcher for a term and store it in the name_index
+    collection so that later imports can load it instead of building
+    it again.
+    """
+    built_at = datetime.datetime.utcnow()
+    matcher = NameMatcher(state, term)
+    doc = matcher.to_document()
+    matcher.digest = doc['digest']
+    doc['_id'] = _index_id(state, term)
+    doc['built_at'] = built_at
+    doc['manual_mtime'] = _manual_mtime(state)
+    db.name_index.save(doc, safe=True)
+    return matcher
+
+
+def build_name_indexes(state):
+    """ build and store the name index of every term of a state """
+    metadata = db.metadata.find_one({'_id': state})
+    for term in metadata['terms']:
+        try:
+            build_name_index(state, term['name'])
+        except ValueError as e:
+            # leave it to be built (and fail) when it is first used
+            _log.warning("can't build name index for %s %s: %s" %
+                         (state, term['name'], e))
+
+
+def get_name_matcher(state, term):
+    """
+    Load the stored NameMatcher for a term, (re)building it if there
+    isn't one or a legislator has changed since it was built.
+    """
+    doc = db.name_index.find_one(_index_id(state, term))
+    if (doc is None or 'digest' not in doc or
+        doc['manual_mtime'] != _manual_mtime(state) or
+        db.legislators.find_one({'state': state,
+                                 'updated_at': {'$gt': doc['built_at']}},
+                                fields=['_id'])):
+        return build_name_index(state, term)
+    return NameMatcher.from_document(doc)
+
+
+def get_name_digest(state, session):
+    """
+    Digest of the names known for a session's term, which changes
+    whenever a name may be matched differently.
+    """
+    return _get_matcher(state, session).digest
+
+
+def _get_matcher(state, session):
     try:
-        matcher = __matchers[(state, session)]
+        return __matchers[(state, session)]
     except KeyError:
         metadata = db.metadata.find_one({'_id': state})
         term = None
@@ -19,13 +97,27 @@ def get_legislator_id(state, session, chamber, name):
         else:
             raise Exception("bad session: " + session)
 
-        matcher = NameMatcher(state, term['name'])
+        matcher = get_name_matcher(state, term['name'])
         __matchers[(state, session)] = matcher
+        return matcher
 
+
+def get_legislator_id(state, session, chamber, name):
     if chamber == 'both' or chamber == 'joint':
         chamber = None
 
-    return matcher.match(name, chamber)
+    return _get_matcher(state, session).match(name, chamber)
+
+
+def get_legislator_ids(state, session, chamber, names):
+    """
+    Like get_legislator_id but resolves a list of names at once,
+    returning a list of leg_ids (or None) in the same order.
+    """
+    if chamber == 'both' or chamber == 'joint':
+        chamber = None
+
+    return _get_matcher(state, session).match_many(names, chamber)
 
 
 class NameMatcher(object):
@@ -66,6 +158,8 @@ class NameMatcher(object):
         self._names = {'upper': {}, 'lower': {}, None: {}}
         self._codes = {'upper': {}, 'lower': {}, None: {}}
         self._manual = {'upper': {}, 'lower': {}, None: {}}
+        self._memo = {'upper': {}, 'lower': {}, None: {}}
+        self._ngrams = {}
         self._state = state
         self._term = term
 
@@ -85,10 +179,41 @@ class NameMatcher(object):
 
         self._learn_manual_matches()
 
+    _tables = ('_names', '_codes', '_manual')
+
+    def to_document(self):
+        """
+        Serialize the matcher. Names are stored as (chamber, name, leg_id)
+        triples since they may not be valid Mongo keys.
+        """
+        doc = {'state': self._state, 'term': self._term}
+        for table in self._tables:
+            doc[table[1:]] = sorted((chamber, name, leg_id)
+                                    for chamber, names in
+                                    getattr(self, table).iteritems()
+                                    for name, leg_id in names.iteritems())
+        doc['digest'] = hashlib.sha1(json.dumps(
+            [doc[table[1:]] for table in self._tables])).hexdigest()
+        return doc
+
+    @classmethod
+    def from_document(cls, doc):
+        """ load a matcher serialized with :meth:`to_document` """
+        matcher = cls.__new__(cls)
+        matcher._state = doc['state']
+        matcher._term = doc['term']
+        matcher.digest = doc.get('digest')
+        matcher._memo = {'upper': {}, 'lower': {}, None: {}}
+        matcher._ngrams = {}
+        for table in cls._tables:
+            names = {'upper': {}, 'lower': {}, None: {}}
+            for chamber, name, leg_id in doc[table[1:]]:
+                names[chamber][name] = leg_id
+            setattr(matcher, table, names)
+        return matcher
+
     def _learn_manual_matches(self):
-        path = os.path.join(os.path.dirname(__file__),
-                            "../../manual_data/leg_ids/%s.csv" %
-                            self._state)
+        path = _manual_path(self._state)
         try:
             with open(path) as f:
                 reader = csv.reader(f)
@@ -203,6 +328,24 @@ class NameMatcher(object):
         with matching chamber. If chamber is None then the search
         will be cross-chamber.
         """
+        memo = self._memo[chamber]
+        try:
+            return memo[name]
+        except KeyError:
+            leg_id = memo[name] = self._match(name, chamber)
+            return leg_id
+
+    def match_many(self, names, chamber=None):
+        """
+        Match a list of names, returning a list of values (or None) in
+        the same order. Each distinct name is only looked up once.
+        """
+        memo = self._memo[chamber]
+        for name in set(names).difference(memo):
+            memo[name] = self._match(name, chamber)
+        return [memo[name] for name in names]
+
+    def _match(self, name, chamber):
         try:
             return self._manual[chamber][name]
         except KeyError:
@@ -213,5 +356,92 @@ class NameMatcher(object):
         except KeyError:
             pass
 
-        name = self._normalize(name)
-        return self._names[chamber].get(name, None)
+        normalized = self._normalize(name)
+        leg_id = self._names[chamber].get(normalized, None)
+
+        # a form that is known but ambiguous is deliberately unmatched
+        threshold = getattr(settings, 'BILLY_FUZZY_MATCH_THRESHOLD', None)
+        if (threshold is not None and
+            normalized not in self._names[chamber]):
+            match = self.fuzzy_match(name, chamber, threshold)
+            if match:
+                leg_id, score, form = match
+                self._report_fuzzy(name, chamber, leg_id, score, form)
+
+        return leg_id
+
+    def _get_ngrams(self, chamber):
+        """
+        Index the unambiguous name forms of a chamber by their trigrams,
+        built the first time a fuzzy match is needed.
+        """
+        try:
+            return self._ngrams[chamber]
+        except KeyError:
+            ngrams = defaultdict(set)
+            for form, leg_id in self._names[chamber].iteritems():
+                if leg_id is not None:
+                    for ngram in _ngrams(form):
+                        ngrams[ngram].add(form)
+            self._ngrams[chamber] = ngrams
+            return ngrams
+
+    def fuzzy_match(self, name, chamber=None, threshold=0.9, candidates=10,
+                    margin=0.05):
+        """
+        Find the closest known name form to name, returning a
+        (value, score, form) tuple or None if no form scores at least
+        threshold or a form of a different person scores within margin
+        of the best one.
+
+        Only the candidates forms sharing the most trigrams with name
+        are scored (with Jaro-Winkler similarity).
+        """
+        name = _unicode(self._normalize(name))
+        ngrams = self._get_ngrams(chamber)
+
+        shared = defaultdict(int)
+        for ngram in _ngrams(name):
+            for form in ngrams.get(ngram, ()):
+                shared[form] += 1
+        # ties are broken by name so the candidates don't depend on dict
+        # order
+        forms = sorted(shared, key=lambda form: (-shared[form], form))
+        forms = forms[:candidates]
+
+        scored = sorted(((jellyfish.jaro_winkler(name, _unicode(form)), form)
+                         for form in forms),
+                        key=lambda scored: (-scored[0], scored[1]))
+        if not scored or scored[0][0] < threshold:
+            return None
+
+        score, form = scored[0]
+        leg_id = self._names[chamber][form]
+        for other_score, other_form in scored[1:]:
+            if other_score <= score - margin:
+                break
+            if self._names[chamber][other_form] != leg_id:
+                return None
+
+        return leg_id, score, form
+
+    def _report_fuzzy(self, name, chamber, leg_id, score, form):
+        """ record a fuzzy match for review with dump_missing_leg_ids """
+        _log.info('fuzzy matched %s to %s (%s, %.3f)' % (name, leg_id, form,
+                                                          score))
+        db.fuzzy_matches.update({'state': self._state, 'term': self._term,
+                                 'chamber': chamber, 'name': name},
+                                {'$set': {'leg_id': leg_id, 'score': score,
+                                          'form': form}},
+                                upsert=True, safe=True)
+
+
+def _unicode(s):
+    if isinstance(s, str):
+        return s.decode('utf8', 'replace')
+    return s
+
+
+def _ngrams(s, n=3):
+    s = ' %s ' % s
+    return set(s[i:i + n] for i in xrange(len(s) - n + 1))
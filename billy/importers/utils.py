@@ -1,9 +1,17 @@
 import os
 import re
+import gzip
 import time
+import errno
+import hashlib
+import StringIO
+import atexit
 import json
+import socket
 import logging
 import datetime
+import itertools
+import threading
 from collections import defaultdict
 
 from pymongo.son import SON
@@ -31,10 +39,28 @@ for _type in ('bill', 'person', 'committee', 'metadata', 'vote', 'event'):
     standard_fields[_type] = _get_property_dict(schema)
 
 
-def insert_with_id(obj):
+_id_types = {'person': ('legislators', 'L'),
+             'legislator': ('legislators', 'L'),
+             'committee': ('committees', 'C'),
+             'bill': ('bills', 'B')}
+
+
+def _get_max_id(collection, id_prefix):
+    """ the largest sequence number already used for id_prefix """
+    id_reg = re.compile('^%s' % id_prefix)
+    cursor = getattr(db, collection).find(
+        {'_id': id_reg}, fields=['_id']).sort('_id', -1).limit(1)
+    try:
+        return int(cursor.next()['_id'][len(id_prefix):])
+    except StopIteration:
+        return 0
+
+
+def assign_id(obj):
     """
     Generates a unique ID for the supplied legislator/committee/bill
-    and inserts it into the appropriate collection.
+    without inserting it, so that new objects can be inserted together.
+    Returns the ID.
     """
     if hasattr(obj, '_id'):
         raise ValueError("object already has '_id' field")
@@ -43,38 +69,47 @@ def insert_with_id(obj):
     obj['created_at'] = datetime.datetime.utcnow()
     obj['updated_at'] = obj['created_at']
 
-    if obj['_type'] == 'person' or obj['_type'] == 'legislator':
-        collection = db.legislators
-        id_type = 'L'
-    elif obj['_type'] == 'committee':
-        collection = db.committees
-        id_type = 'C'
-    elif obj['_type'] == 'bill':
-        collection = db.bills
-        id_type = 'B'
+    collection, id_type = _id_types[obj['_type']]
+    id_prefix = '%s%s' % (obj['state'].upper(), id_type)
 
-    id_reg = re.compile('^%s%s' % (obj['state'].upper(), id_type))
+    # the counter starts after any IDs handed out before it existed
+    allocator = get_allocator('%s_ids' % collection[:-1], obj['state'],
+                              seed=lambda: _get_max_id(collection,
+                                                       id_prefix))
 
-    # Find the next available _id and insert
-    id_prefix = '%s%s' % (obj['state'].upper(), id_type)
-    cursor = collection.find({'_id': id_reg}).sort('_id', -1).limit(1)
+    obj['_id'] = '%s%06d' % (id_prefix, allocator.next())
+    obj['_all_ids'] = [obj['_id']]
 
-    try:
-        new_id = int(cursor.next()['_id'][3:]) + 1
-    except StopIteration:
-        new_id = 1
+    if obj['_type'] in ['person', 'legislator']:
+        obj['leg_id'] = obj['_id']
 
-    while True:
-        obj['_id'] = '%s%06d' % (id_prefix, new_id)
-        obj['_all_ids'] = [obj['_id']]
+    return obj['_id']
 
-        if obj['_type'] in ['person', 'legislator']:
-            obj['leg_id'] = obj['_id']
 
+def insert_with_id(obj):
+    """
+    Generates a unique ID for the supplied legislator/committee/bill
+    and inserts it into the appropriate collection.
+    """
+    collection = getattr(db, _id_types[obj['_type']][0])
+
+    while True:
+        assign_id(obj)
         try:
             return collection.insert(obj, safe=True)
         except pymongo.errors.DuplicateKeyError:
-            new_id += 1
+            # only happens if the counter was reset behind our back
+            del obj['_id']
+
+
+def chunks(iterable, size):
+    """ split an iterable into lists of (at most) size items """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 
 def timestamp_to_dt(timestamp):
@@ -86,14 +121,18 @@ def timestamp_to_dt(timestamp):
 
 
 def update(old, new, coll):
+    """
+    Merge new into old, saving old to coll if anything changed. If coll
+    is None old is only updated in memory. Returns whether old changed.
+    """
     # To prevent deleting standalone votes..
     if 'votes' in new and not new['votes']:
         del new['votes']
 
     # need_save = something has changed
     # updated = the updated_at field needs bumping
-    # (we don't bump updated_at if only the sources list has changed, but
-    #  we still update the object)
+    # (we don't bump updated_at if only the sources list or the import
+    #  fingerprint has changed, but we still update the object)
     need_save, updated = False, False
 
     locked_fields = old.get('_locked_fields', [])
@@ -107,7 +146,7 @@ def update(old, new, coll):
             old[key] = value
 
             need_save = True
-            if key != 'sources':
+            if key not in ('sources', '_content_hash'):
                 updated = True
 
         # remove old +key field if this field no longer has a +
@@ -119,9 +158,11 @@ def update(old, new, coll):
     if updated:
         old['updated_at'] = datetime.datetime.utcnow()
 
-    if need_save:
+    if need_save and coll is not None:
         coll.save(old, safe=True)
 
+    return need_save
+
 
 def convert_timestamps(obj):
     """
@@ -240,24 +281,203 @@ def get_committee_id(state, chamber, committee):
     return __committee_ids[key]
 
 
+__committee_digests = {}
+
+
+def get_committee_digest(state):
+    """
+    Digest of the state's committees as seen by :func:`get_committee_id`,
+    which changes whenever a committee vote may be matched differently.
+    """
+    try:
+        return __committee_digests[state]
+    except KeyError:
+        committees = sorted((c['chamber'], c['committee'], c['_id'])
+                            for c in db.committees.find(
+                                {'state': state, 'subcommittee': None},
+                                fields=['chamber', 'committee']))
+        digest = hashlib.sha1(json.dumps(committees)).hexdigest()
+        __committee_digests[state] = digest
+        return digest
+
+
+class IdAllocator(object):
+    """
+    Hands out sequence numbers from a counter collection, reserving
+    them from the database block_size at a time instead of bumping the
+    counter once per object.
+
+    Numbers are never handed out twice, even across processes, but
+    reserved numbers that don't get used leave gaps unless they are
+    given back with :meth:`release`.
+    """
+
+    def __init__(self, collection, key, block_size=100, seed=None):
+        """
+        :param collection: name of the counter collection (eg. 'vote_ids')
+        :param key: _id of the counter document (usually the state)
+        :param block_size: how many numbers to reserve at a time
+        :param seed: optional function returning the number to count on
+            from if the counter doesn't exist yet
+        """
+        self.collection = collection
+        self.key = key
+        self.block_size = block_size
+        self.seed = seed
+        self._next = 1
+        self._end = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _seed(self):
+        counters = getattr(db, self.collection)
+        if counters.find_one({'_id': self.key}):
+            return
+        try:
+            counters.insert({'_id': self.key, 'seq': self.seed()}, safe=True)
+        except pymongo.errors.DuplicateKeyError:
+            # another process seeded it first
+            pass
+
+    def _reserve(self, n):
+        if self.seed and self._pid is None:
+            self._seed()
+
+        query = SON([('_id', self.key)])
+        update = SON([('$inc', SON([('seq', n)]))])
+        seq = db.command(SON([('findandmodify', self.collection),
+                              ('query', query),
+                              ('update', update),
+                              ('new', True),
+                              ('upsert', True)]))['value']['seq']
+        self._next = seq - n + 1
+        self._end = seq
+        self._pid = os.getpid()
+
+    def next(self):
+        with self._lock:
+            # a forked child must not hand out its parent's block
+            if self._next > self._end or self._pid != os.getpid():
+                self._reserve(self.block_size)
+            seq = self._next
+            self._next += 1
+            return seq
+
+    def release(self):
+        """
+        Give back the unused part of the current block, provided nobody
+        has reserved numbers after it (otherwise they are skipped).
+        """
+        with self._lock:
+            if self._next > self._end or self._pid != os.getpid():
+                return
+            getattr(db, self.collection).update(
+                {'_id': self.key, 'seq': self._end},
+                {'$inc': {'seq': self._next - self._end - 1}}, safe=True)
+            self._next = self._end + 1
+
+
+__allocators = {}
+
+
+def get_allocator(collection, key, seed=None):
+    """ get the process-wide IdAllocator for a counter """
+    try:
+        return __allocators[(collection, key)]
+    except KeyError:
+        allocator = IdAllocator(collection, key, seed=seed)
+        __allocators[(collection, key)] = allocator
+        return allocator
+
+
+@atexit.register
+def release_ids():
+    """ give back unused IDs from every allocator in this process """
+    for allocator in __allocators.values():
+        try:
+            allocator.release()
+        except pymongo.errors.PyMongoError:
+            # the IDs are skipped, which is harmless
+            pass
+
+
+class ImportLocked(Exception):
+    """ raised when another importer is already working on a state """
+
+
+def lock_state(state):
+    """
+    Take the import lock for a state, raising ImportLocked if another
+    importer holds it. Locks left behind by importers that died on this
+    host are taken over.
+    """
+    lock = {'_id': state, 'host': socket.gethostname(), 'pid': os.getpid(),
+            'started': datetime.datetime.utcnow()}
+    while True:
+        try:
+            db.import_locks.insert(lock, safe=True)
+            return
+        except pymongo.errors.DuplicateKeyError:
+            held = db.import_locks.find_one({'_id': state})
+            if not held:
+                continue
+            if held['host'] == lock['host'] and not _pid_alive(held['pid']):
+                db.import_locks.remove({'_id': state, 'pid': held['pid']},
+                                       safe=True)
+                continue
+            raise ImportLocked('%s is being imported by pid %s on %s '
+                               'since %s' % (state, held['pid'],
+                                             held['host'], held['started']))
+
+
+def unlock_state(state):
+    db.import_locks.remove({'_id': state, 'host': socket.gethostname(),
+                            'pid': os.getpid()}, safe=True)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
 def put_document(doc, content_type, metadata):
+    """
+    Store a document in GridFS, returning its id.
+
+    Documents are stored gzip-compressed along with the SHA-1 of their
+    contents. A document that is already stored isn't stored again, the
+    id of the existing copy is returned instead.
+    """
+    sha1 = hashlib.sha1(doc).hexdigest()
+    existing = db.documents.files.find_one({'sha1': sha1}, fields=['_id'])
+    if existing:
+        logging.info("Already saved as %s" % existing['_id'])
+        return existing['_id']
+
     # Generate a new sequential ID for the document
-    query = SON([('_id', metadata['bill']['state'])])
-    update = SON([('$inc', SON([('seq', 1)]))])
-    seq = db.command(SON([('findandmodify', 'doc_ids'),
-                          ('query', query),
-                          ('update', update),
-                          ('new', True),
-                          ('upsert', True)]))['value']['seq']
+    seq = get_allocator('doc_ids', metadata['bill']['state']).next()
 
     id = "%sD%08d" % (metadata['bill']['state'].upper(), seq)
     logging.info("Saving as %s" % id)
 
-    fs.put(doc, _id=id, content_type=content_type, metadata=metadata)
+    fs.put(gzip_document(doc), _id=id, content_type=content_type,
+           metadata=metadata, sha1=sha1, compression='gzip',
+           uncompressed_length=len(doc))
 
     return id
 
 
+def gzip_document(doc):
+    buf = StringIO.StringIO()
+    # a fixed mtime keeps the output the same for the same document
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+        f.write(doc)
+    return buf.getvalue()
+
+
 def merge_legislators(old, new):
     all_ids = set(old['_all_ids']).union(new['_all_ids'])
     new['_all_ids'] = list(all_ids)
@@ -284,14 +504,7 @@ class VoteMatcher(object):
 
     def get_next_id(self):
         # Generate a new sequential ID for the vote
-        query = SON([('_id', self.state)])
-        update = SON([('$inc', SON([('seq', 1)]))])
-        seq = db.command(SON([('findandmodify', 'vote_ids'),
-                              ('query', query),
-                              ('update', update),
-                              ('new', True),
-                              ('upsert', True)]))['value']['seq']
-
+        seq = get_allocator('vote_ids', self.state).next()
         return "%sV%08d" % (self.state.upper(), seq)
 
     def key_for_vote(self, vote):
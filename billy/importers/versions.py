@@ -1,27 +1,161 @@
 #!/usr/bin/env python
 import sys
+import time
+import Queue
 import logging
+import urlparse
+import threading
 
 from pymongo.son import SON
 
 import scrapelib
 
 from billy import db, fs
+from billy.conf import settings
 from billy.importers.utils import put_document
 
+# number of downloaded versions to store before writing their
+# document_ids to the bills
+FLUSH_SIZE = 20
 
-def import_versions(state, rpm=60):
-    scraper = scrapelib.Scraper(requests_per_minute=rpm)
 
-    for bill in db.bills.find({'state': state}):
-        logging.info("Importing %s" % bill['bill_id'])
+class TokenBucket(object):
+    """
+    Allow up to rpm requests per minute, in bursts of at most burst
+    requests. take() blocks until a request is allowed. An rpm of 0 (or
+    less) doesn't limit requests at all.
+    """
 
-        bill_changed = False
-        for version in bill['versions']:
+    def __init__(self, rpm, burst=1):
+        self.rate = rpm / 60.0
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def take(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostBuckets(object):
+    """ a TokenBucket per host, created as hosts are seen """
+
+    def __init__(self, rpm):
+        self.rpm = rpm
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, url):
+        host = urlparse.urlparse(url).netloc
+        with self._lock:
+            try:
+                bucket = self._buckets[host]
+            except KeyError:
+                bucket = self._buckets[host] = TokenBucket(self.rpm)
+        bucket.take()
+
+
+def _missing_versions(state):
+    """
+    Yield (bill, version index) for every version of the state's bills
+    that hasn't been downloaded yet.
+    """
+    for bill in db.bills.find({'state': state,
+                               'versions': {'$elemMatch': {
+                                   'url': {'$exists': True},
+                                   'document_id': {'$exists': False}}}},
+                              fields=['state', 'chamber', 'session',
+                                      'bill_id', 'title', 'versions']):
+        for n, version in enumerate(bill['versions']):
             if 'document_id' in version or 'url' not in version:
                 continue
+            yield bill, n
+
+
+def _download(tasks, results, buckets):
+    # scrapelib throttling is replaced by the per-host buckets
+    scraper = scrapelib.Scraper(requests_per_minute=0,
+                                timeout=settings.SCRAPELIB_TIMEOUT)
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+
+            bill, n = task
+            url = bill['versions'][n]['url']
+            try:
+                buckets.take(url)
+                doc = scraper.urlopen(url)
+                content_type = doc.response.headers.get('content-type')
+            except Exception as e:
+                logging.error("Failed to download %s: %s" % (url, e))
+                continue
+            results.put((bill, n, doc, content_type))
+    finally:
+        # import_versions waits for one None from every downloader
+        results.put(None)
 
-            doc = scraper.urlopen(version['url'])
+
+def import_versions(state, rpm=60, workers=4):
+    """
+    Download the state's missing bill versions into GridFS.
+
+    Versions are fetched by a pool of workers threads while no more than
+    rpm requests per minute are made to any one host. Each bill's new
+    document_ids are written every FLUSH_SIZE downloads, so an
+    interrupted run picks up where it left off.
+    """
+    # documents are looked up by content hash before they are stored
+    db.documents.files.ensure_index('sha1')
+
+    buckets = HostBuckets(rpm)
+    tasks = Queue.Queue(workers * 2)
+    results = Queue.Queue(workers * 2)
+
+    def produce():
+        try:
+            for task in _missing_versions(state):
+                tasks.put(task)
+        finally:
+            for i in xrange(workers):
+                tasks.put(None)
+
+    threads = [threading.Thread(target=produce)]
+    threads.extend(threading.Thread(target=_download,
+                                    args=(tasks, results, buckets))
+                   for i in xrange(workers))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    pending = {}
+    count = 0
+    running = workers
+    try:
+        while running:
+            result = results.get()
+            if result is None:
+                running -= 1
+                continue
+
+            bill, n, doc, content_type = result
+            version = bill['versions'][n]
+            logging.info("Importing %s %s" % (bill['bill_id'],
+                                              version['name']))
 
             metadata = {'bill': {'state': bill['state'],
                                  'chamber': bill['chamber'],
@@ -31,11 +165,25 @@ def import_versions(state, rpm=60):
                         'name': version['name'],
                         'url': version['url']}
 
-            content_type = doc.response.headers['content-type']
+            doc_id = put_document(doc, content_type, metadata)
+            pending.setdefault(bill['_id'], {})[
+                'versions.%d.document_id' % n] = doc_id
+            count += 1
+
+            if count % FLUSH_SIZE == 0:
+                _flush(pending)
+    finally:
+        # keep the versions stored so far even if the run fails
+        _flush(pending)
+
+    for thread in threads:
+        thread.join()
+
+    print 'imported %s versions' % count
 
-            version['document_id'] = put_document(doc, content_type,
-                                                  metadata)
-            bill_changed = True
 
-        if bill_changed:
-            db.bills.save(bill)
+def _flush(pending):
+    """ write the collected document_ids, one update per bill """
+    for bill_id, fields in pending.iteritems():
+        db.bills.update({'_id': bill_id}, {'$set': fields}, safe=True)
+    pending.clear()
@@ -1,6 +1,9 @@
 import os
+import sys
 import time
+import Queue
 import logging
+import threading
 import urllib2
 import datetime
 import contextlib
@@ -9,6 +12,7 @@ from optparse import make_option, OptionParser
 from collections import defaultdict
 
 from billy.scrape.validator import DatetimeValidator
+from billy.scrape.cache import get_cache
 
 from billy.conf import settings
 
@@ -62,6 +66,35 @@ class ScraperMeta(type):
         return cls
 
 
+class HttpPool(object):
+    """
+    Pool of httplib2.Http objects shared by every scraper in a process.
+
+    Each Http object keeps a persistent connection to every host it has
+    talked to, so handing them out from one pool lets the bill, vote and
+    committee scrapers of a run (and the threads of
+    :meth:`Scraper.urlopen_many`) reuse open connections instead of
+    paying for a new TCP/TLS handshake on each request.
+    """
+
+    def __init__(self):
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def checkout(self, cache, timeout):
+        with self._lock:
+            idle = self._idle[(cache, timeout)]
+            if idle:
+                return idle.pop()
+        return scrapelib.httplib2.Http(cache, timeout=timeout)
+
+    def checkin(self, cache, timeout, http):
+        with self._lock:
+            self._idle[(cache, timeout)].append(http)
+
+_http_pool = HttpPool()
+
+
 class Scraper(scrapelib.Scraper):
     """ Base class for all Scrapers
 
@@ -72,7 +105,7 @@ class Scraper(scrapelib.Scraper):
     __metaclass__ = ScraperMeta
 
     def __init__(self, metadata, no_cache=False, output_dir=None,
-                 strict_validation=None, **kwargs):
+                 strict_validation=None, revalidate=False, **kwargs):
         """
         Create a new Scraper instance.
 
@@ -80,6 +113,9 @@ class Scraper(scrapelib.Scraper):
         :param no_cache: if True, will ignore any cached downloads
         :param output_dir: the data directory to use
         :param strict_validation: exit immediately if validation fails
+        :param revalidate: if True and use_cache_first is set, cached pages
+            with an ETag or Last-Modified header are revalidated with a
+            conditional GET instead of being used as-is
         """
 
         # configure underlying scrapelib object
@@ -88,6 +124,13 @@ class Scraper(scrapelib.Scraper):
         elif 'cache_dir' not in kwargs:
             kwargs['cache_dir'] = settings.BILLY_CACHE_DIR
 
+        if (kwargs['cache_dir'] and settings.BILLY_CACHE_HASHED and
+            'cache_obj' not in kwargs):
+            kwargs['cache_obj'] = get_cache(
+                kwargs['cache_dir'],
+                getattr(settings, 'BILLY_CACHE_MAX_SIZE', None),
+                getattr(settings, 'BILLY_CACHE_TTL', None))
+
         if 'error_dir' not in kwargs:
             kwargs['error_dir'] = settings.BILLY_ERROR_DIR
 
@@ -103,6 +146,11 @@ class Scraper(scrapelib.Scraper):
         if 'retry_wait_seconds' not in kwargs:
             kwargs['retry_wait_seconds'] = settings.SCRAPELIB_RETRY_WAIT_SECONDS
 
+        # per-thread state, must exist before scrapelib assigns _http
+        self._local = threading.local()
+        self._base_http = None
+        self._throttle_lock = threading.Lock()
+
         super(Scraper, self).__init__(**kwargs)
 
         if not hasattr(self, 'state'):
@@ -110,6 +158,7 @@ class Scraper(scrapelib.Scraper):
 
         self.metadata = metadata
         self.output_dir = output_dir
+        self.revalidate = revalidate
 
         # validation
         self.strict_validation = strict_validation
@@ -123,6 +172,120 @@ class Scraper(scrapelib.Scraper):
         self.debug = self.logger.debug
         self.warning = self.logger.warning
 
+    # scrapelib keeps a single httplib2.Http object, instead each request
+    # checks one out of the shared pool for the thread making it and
+    # _base_http only holds settings such as follow_redirects
+    @property
+    def _http(self):
+        return getattr(self._local, 'http', None) or self._base_http
+
+    @_http.setter
+    def _http(self, value):
+        # scrapelib replaces the Http object if its connection breaks
+        if getattr(self._local, 'http', None):
+            self._local.http = value
+        else:
+            self._base_http = value
+
+    def urlopen(self, url, method='GET', body=None, retry_on_404=False):
+        # no httplib2 or already inside a request (following a redirect)
+        if not self._base_http or getattr(self._local, 'http', None):
+            return super(Scraper, self).urlopen(url, method, body,
+                                                retry_on_404)
+
+        http = _http_pool.checkout(self._cache_obj, self.timeout)
+        http.follow_redirects = self._base_http.follow_redirects
+        self._local.http = http
+        try:
+            self._local.revalidate = (self.use_cache_first and
+                                      self.revalidate and
+                                      method.upper() == 'GET' and
+                                      self._has_validators(url))
+            return super(Scraper, self).urlopen(url, method, body,
+                                                retry_on_404)
+        finally:
+            http = self._local.http
+            self._local.http = None
+            self._local.revalidate = False
+            _http_pool.checkin(self._cache_obj, self.timeout, http)
+
+    def _has_validators(self, url):
+        """
+        Check if the cached copy of url has an ETag or Last-Modified
+        header, without touching the network.
+        """
+        if not self._cache_obj or '://' not in url:
+            return False
+        resp, content = self._http.request(
+            url, 'GET', headers={'cache-control': 'only-if-cached'})
+        return resp.status != 504 and ('etag' in resp or
+                                       'last-modified' in resp)
+
+    def _make_headers(self, url):
+        headers = super(Scraper, self)._make_headers(url)
+        # with max-age=0 httplib2 treats the cached copy as stale and
+        # sends If-None-Match/If-Modified-Since, serving it on a 304
+        if getattr(self._local, 'revalidate', False):
+            headers['Cache-Control'] = 'max-age=0'
+        return headers
+
+    def _throttle(self):
+        with self._throttle_lock:
+            super(Scraper, self)._throttle()
+
+    def urlopen_many(self, urls, workers=4, **kwargs):
+        """
+        Fetch several URLs concurrently, yielding ``(url, result)`` pairs
+        as the responses complete.
+
+        Each request goes through :meth:`urlopen` so rate-limiting,
+        retries and caching apply just as they do to single requests.
+        If a request raises an exception it is re-raised here and the
+        remaining URLs are not fetched.
+
+        :param urls: iterable of URLs to fetch
+        :param workers: maximum number of requests in flight at once
+        :param kwargs: extra arguments passed on to :meth:`urlopen`
+        """
+        urls = list(urls)
+        todo = Queue.Queue()
+        done = Queue.Queue()
+        for url in urls:
+            todo.put(url)
+
+        def fetch():
+            while True:
+                try:
+                    url = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    done.put((url, self.urlopen(url, **kwargs), None))
+                except Exception:
+                    done.put((url, None, sys.exc_info()))
+
+        threads = [threading.Thread(target=fetch)
+                   for i in xrange(min(workers, len(urls)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            for i in xrange(len(urls)):
+                url, result, exc_info = done.get()
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                yield url, result
+        finally:
+            # stop workers from picking up any more URLs
+            while True:
+                try:
+                    todo.get_nowait()
+                except Queue.Empty:
+                    break
+            for thread in threads:
+                thread.join()
+
     def validate_json(self, obj):
         if not hasattr(self, '_schema'):
             self._schema = self._get_schema()
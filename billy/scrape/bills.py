@@ -1,5 +1,7 @@
 import os
 import json
+import calendar
+import datetime
 
 from billy.scrape import Scraper, SourcedObject, JSONDateEncoder
 
@@ -8,6 +10,17 @@ class BillScraper(Scraper):
 
     scraper_type = 'bills'
 
+    def __init__(self, *args, **kwargs):
+        """
+        Create a new BillScraper instance.
+
+        :param incremental_dir: if set, the data directory of previous
+            runs, enables :meth:`bill_unchanged` and :meth:`updated_since`
+        """
+        self.incremental_dir = kwargs.pop('incremental_dir', None)
+        self._incremental = {}
+        super(BillScraper, self).__init__(*args, **kwargs)
+
     def _get_schema(self):
         schema_path = os.path.join(os.path.split(__file__)[0],
                                    '../schemas/bill.json')
@@ -45,6 +58,92 @@ class BillScraper(Scraper):
             json.dump(bill, f, cls=JSONDateEncoder)
 
 
+    def _incremental_path(self, chamber, session):
+        filename = "bills_%s_%s.json" % (session, chamber)
+        filename = filename.encode('ascii', 'replace')
+        return os.path.join(self.incremental_dir, 'incremental', filename)
+
+    def _get_incremental(self, chamber, session):
+        key = (chamber, session)
+        if key not in self._incremental:
+            try:
+                with open(self._incremental_path(chamber, session)) as f:
+                    self._incremental[key] = json.load(f)
+            except IOError:
+                self._incremental[key] = {'updated': None,
+                                          'fingerprints': {}}
+            self._incremental[key]['seen'] = {}
+        return self._incremental[key]
+
+    def updated_since(self, chamber, session):
+        """
+        Get the time of the last successful incremental scrape of
+        chamber and session (as a UTC datetime), or None if there hasn't
+        been one or incremental scraping is off.
+
+        Scrapers for states that can list bills changed since a given date
+        can use this to limit what they walk.
+        """
+        if not self.incremental_dir:
+            return None
+        updated = self._get_incremental(chamber, session)['updated']
+        if updated:
+            return datetime.datetime.utcfromtimestamp(updated)
+
+    def bill_unchanged(self, chamber, session, bill_id, fingerprint):
+        """
+        Check whether a bill is unchanged since the last incremental
+        scrape, in which case the scraper may skip fetching its details
+        and saving it again.
+
+        Should be called for every bill found while scraping chamber and
+        session (as passed to :meth:`scrape`), even ones that then get
+        saved, so that their fingerprint is remembered for the next run.
+
+        :param bill_id: the bill's id as it appears on the index page
+        :param fingerprint: a JSON-serializable summary of the bill taken
+            from the index page, such as its last action date and status
+        """
+        if not self.incremental_dir:
+            return False
+
+        state = self._get_incremental(chamber, session)
+        fingerprint = json.loads(json.dumps(fingerprint, cls=JSONDateEncoder))
+        state['seen'][bill_id] = fingerprint
+
+        if state['fingerprints'].get(bill_id) != fingerprint:
+            return False
+
+        # only skip bills whose output from the last run is still around
+        filename = "%s_%s_%s.json" % (session, chamber, bill_id)
+        filename = filename.encode('ascii', 'replace')
+        return os.path.exists(os.path.join(self.incremental_dir, 'bills',
+                                           filename))
+
+    def save_watermark(self, chamber, session, started):
+        """
+        Record a successful scrape of chamber and session that began at
+        started (a UTC datetime), along with every fingerprint passed to
+        :meth:`bill_unchanged` during it.
+        """
+        if not self.incremental_dir:
+            return
+
+        state = self._get_incremental(chamber, session)
+        state['fingerprints'].update(state.pop('seen'))
+        state['updated'] = calendar.timegm(started.utctimetuple())
+
+        path = self._incremental_path(chamber, session)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != 17:
+                raise e
+        with open(path, 'w') as f:
+            json.dump(state, f)
+        state['seen'] = {}
+
+
 class Bill(SourcedObject):
     """
     Object representing a piece of legislation.
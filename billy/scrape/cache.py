@@ -0,0 +1,268 @@
+import os
+import time
+import zlib
+import hashlib
+import atexit
+import sqlite3
+import weakref
+import tempfile
+import threading
+
+# number of cache hits whose access times are kept in memory before they
+# are written to the index (only tracked when there is a max_size)
+ACCESS_FLUSH_SIZE = 500
+
+# once over max_size, entries are evicted until the bodies take up no
+# more than this fraction of it, so eviction doesn't run on every write
+EVICT_LOW_WATER = 0.9
+
+# number of least recently used entries read at a time while evicting
+EVICT_BATCH_SIZE = 100
+
+# every cache in this process, so pending access times can be written
+# on exit
+_instances = weakref.WeakSet()
+
+
+class HashedCache(object):
+    """
+    Implements the httplib2 cache protocol, storing response bodies by
+    content hash.
+
+    Bodies are zlib-compressed and written once per distinct body no
+    matter how many URLs return it, while a small sqlite index maps each
+    URL to its response headers and body hash. Entries older than
+    `ttl` seconds are treated as missing, and once the bodies on disk
+    exceed `max_size` bytes the least recently used entries are evicted
+    (down to EVICT_LOW_WATER of it). Access times are only tracked when
+    there is a `max_size`, and are written in batches, so :meth:`close`
+    should be called when done with the cache (done at exit for every
+    cache by :func:`close_caches`).
+    """
+
+    def __init__(self, path, max_size=None, ttl=None):
+        """
+        :param path: directory to store the cache in
+        :param max_size: maximum size (in bytes) of stored bodies, None for
+            no limit
+        :param ttl: maximum age (in seconds) of an entry, None for no limit
+        """
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._accessed = {}
+        _instances.add(self)
+
+        try:
+            os.makedirs(os.path.join(path, 'objects'))
+        except OSError as e:
+            if e.errno != 17:
+                raise e
+
+    @property
+    def db(self):
+        # sqlite connections can't be shared with forked processes
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(os.path.join(self.path, 'index.db'),
+                                       timeout=60, check_same_thread=False,
+                                       isolation_level=None)
+            self._db.text_factory = str
+            self._db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                             'key TEXT PRIMARY KEY, headers BLOB, hash TEXT, '
+                             'stored REAL, accessed REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_hash '
+                             'ON entries (hash)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_accessed '
+                             'ON entries (accessed)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS bodies ('
+                             'hash TEXT PRIMARY KEY, size INTEGER)')
+            # running total of the body sizes, kept up to date as bodies
+            # are added and removed
+            self._db.execute('CREATE TABLE IF NOT EXISTS total ('
+                             'size INTEGER)')
+            self._db.execute('INSERT INTO total SELECT COALESCE(SUM(size), 0) '
+                             'FROM bodies WHERE NOT EXISTS '
+                             '(SELECT 1 FROM total)')
+            self._accessed = {}
+            self._pid = os.getpid()
+        return self._db
+
+    def _body_path(self, hash):
+        return os.path.join(self.path, 'objects', hash[:2], hash[2:])
+
+    def get(self, key):
+        with self._lock:
+            row = self.db.execute('SELECT headers, hash, stored FROM entries '
+                                  'WHERE key = ?', (key,)).fetchone()
+            if not row:
+                return None
+
+            headers, hash, stored = row
+            now = time.time()
+            if self.ttl is not None and now - stored > self.ttl:
+                self._delete(key)
+                return None
+
+            try:
+                with open(self._body_path(hash), 'rb') as f:
+                    body = zlib.decompress(f.read())
+            except (IOError, zlib.error):
+                self._delete(key)
+                return None
+
+            # access times only matter for eviction, and are written in
+            # batches rather than on every hit
+            if self.max_size is not None:
+                self._accessed[key] = now
+                if len(self._accessed) >= ACCESS_FLUSH_SIZE:
+                    self._flush_accessed()
+
+        return headers + '\r\n\r\n' + body
+
+    def set(self, key, value):
+        try:
+            headers, body = value.split('\r\n\r\n', 1)
+        except ValueError:
+            return
+
+        hash = hashlib.sha1(body).hexdigest()
+        now = time.time()
+
+        with self._lock:
+            if not self.db.execute('SELECT 1 FROM bodies WHERE hash = ?',
+                                   (hash,)).fetchone():
+                size = self._write_body(hash, body)
+                if self.db.execute('INSERT OR IGNORE INTO bodies '
+                                   'VALUES (?, ?)', (hash, size)).rowcount:
+                    self.db.execute('UPDATE total SET size = size + ?',
+                                    (size,))
+
+            old = self.db.execute('SELECT hash FROM entries WHERE key = ?',
+                                  (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO entries '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (key, headers, hash, now, now))
+            # a newer access time than any pending one
+            self._accessed.pop(key, None)
+            if old and old[0] != hash:
+                self._release(old[0])
+
+            if self.max_size is not None:
+                self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            self._delete(key)
+
+    def close(self):
+        """ write any pending access times """
+        with self._lock:
+            self._flush_accessed()
+
+    def _write_body(self, hash, body):
+        path = self._body_path(hash)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != 17:
+                raise e
+
+        data = zlib.compress(body)
+        # write to a temp file first so readers never see a partial body
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+        return len(data)
+
+    def _delete(self, key):
+        """ remove an entry, returning the number of bytes freed """
+        row = self.db.execute('SELECT hash FROM entries WHERE key = ?',
+                              (key,)).fetchone()
+        if not row:
+            return 0
+        self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+        return self._release(row[0])
+
+    def _release(self, hash):
+        """ remove a body once no entry refers to it """
+        if self.db.execute('SELECT 1 FROM entries WHERE hash = ?',
+                           (hash,)).fetchone():
+            return 0
+        row = self.db.execute('SELECT size FROM bodies WHERE hash = ?',
+                              (hash,)).fetchone()
+        if not row or not self.db.execute('DELETE FROM bodies WHERE hash = ?',
+                                          (hash,)).rowcount:
+            return 0
+        self.db.execute('UPDATE total SET size = size - ?', (row[0],))
+        try:
+            os.remove(self._body_path(hash))
+        except OSError:
+            pass
+        return row[0]
+
+    def _flush_accessed(self):
+        """ write the pending access times in one transaction """
+        if not self._accessed:
+            return
+        self.db.execute('BEGIN')
+        try:
+            self.db.executemany('UPDATE entries SET accessed = ? '
+                                'WHERE key = ?',
+                                [(accessed, key) for key, accessed in
+                                 self._accessed.iteritems()])
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+        self._accessed.clear()
+
+    def _evict(self):
+        """ drop least recently used entries until well under max_size """
+        total = self.db.execute('SELECT size FROM total').fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        self._flush_accessed()
+        low_water = self.max_size * EVICT_LOW_WATER
+        while total > low_water:
+            keys = [key for (key,) in self.db.execute(
+                'SELECT key FROM entries ORDER BY accessed LIMIT ?',
+                (EVICT_BATCH_SIZE,))]
+            if not keys:
+                break
+            for key in keys:
+                total -= self._delete(key)
+                if total <= low_water:
+                    break
+
+
+@atexit.register
+def close_caches():
+    """
+    Write the pending access times of every cache in this process.
+    Processes that exit without running atexit handlers (such as pool
+    workers) must call this themselves.
+    """
+    for cache in list(_instances):
+        cache.close()
+
+
+_caches = {}
+
+
+def get_cache(path, max_size=None, ttl=None):
+    """
+    Get the :class:`HashedCache` for path, creating it if needed.
+
+    Scrapers using the same directory share one cache object, which also
+    lets them share pooled HTTP connections.
+    """
+    key = (path, max_size, ttl)
+    if key not in _caches:
+        _caches[key] = HashedCache(path, max_size, ttl)
+    return _caches[key]
@@ -1,52 +1,231 @@
 #!/usr/bin/env python
+import re
 import sys
 import logging
 import argparse
-
-from pymongo.son import SON
-
-import urllib
-import urllib2_file
+import datetime
 import urllib2
+from collections import defaultdict
+from xml.sax.saxutils import escape
+
+import gridfs
 
 from billy import db, fs
-from billy.utils import base_arg_parser
+from billy.conf import base_arg_parser, settings
+from billy.utils import read_document
+from billy.extract import TextExtractor
+
+# number of documents sent to Solr in one update request
+BATCH_SIZE = 50
+
+# number of batches between commits, documents are only recorded as
+# indexed once they have been committed
+COMMIT_EVERY = 20
+
+# characters that aren't allowed in XML 1.0
+_invalid_xml_re = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class SolrUpdater(object):
+    """
+    Send documents to a Solr XML update handler, batch_size documents
+    per request.
+    """
+
+    def __init__(self, solr_url, batch_size=BATCH_SIZE):
+        self.update_url = solr_url.rstrip('/') + '/update'
+        self.batch_size = batch_size
+        self._batch = []
+
+    def add(self, doc):
+        """
+        Queue a document (a dict of field names to values or lists of
+        values) to be added, sending the batch once it is full.
+        """
+        self._batch.append(doc)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._batch:
+            return
+        xml = [u'<add>']
+        for doc in self._batch:
+            xml.append(u'<doc>')
+            for field, values in sorted(doc.iteritems()):
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
+                for value in values:
+                    if value is None:
+                        continue
+                    value = _invalid_xml_re.sub(u'', unicode(value))
+                    xml.append(u'<field name="%s">%s</field>' %
+                               (field, escape(value)))
+            xml.append(u'</doc>')
+        xml.append(u'</add>')
+        self._post(u''.join(xml))
+        self._batch = []
+
+    def delete(self, ids):
+        """ delete documents by id, sending any queued documents first """
+        self.flush()
+        self._post(u'<delete>%s</delete>' % u''.join(
+            u'<id>%s</id>' % escape(unicode(id)) for id in ids))
+
+    def commit(self):
+        self.flush()
+        self._post(u'<commit/>')
+
+    def _post(self, xml):
+        req = urllib2.Request(self.update_url, xml.encode('utf8'),
+                              {'Content-Type': 'text/xml; charset=utf-8'})
+        urllib2.urlopen(req).read()
+
+
+def _solr_document(solr_id, bill, versions, content_type, text):
+    """
+    Build the Solr document for a bill's versions stored as one document.
+    Documents are shared by every bill with the same version, so the
+    bill's own details are used rather than the document metadata.
+    """
+    return {'id': solr_id,
+            'bill_id': bill['bill_id'],
+            'state': bill['state'],
+            'chamber': bill['chamber'],
+            'bill_title': bill['title'],
+            # document_name is multiValued in schema.xml
+            'document_name': [version['name'] for version in versions],
+            'url': versions[0]['url'],
+            'content_type': content_type,
+            'text': text}
 
 
-def import_versions(state, solr_url="http://localhost:8983/solr/"):
-    for bill in db.bills.find({'state': state}):
+def _read_documents(unindexed):
+    for document_id, bills in unindexed.iteritems():
+        try:
+            doc = fs.get(document_id)
+        except gridfs.NoFile:
+            logging.error("Missing document %s" % document_id)
+            continue
+        yield ((document_id, bills, doc.content_type), read_document(doc),
+               doc.content_type)
+
+
+def _unindexed_documents(state):
+    """
+    Find the state's bill versions that aren't indexed, returning a dict
+    of document_id to the [(solr_id, bill, versions)] stored as it.
+    """
+    indexed = set(doc['_id'] for doc in
+                  db.indexed_documents.find({'state': state},
+                                            fields=['_id']))
+
+    unindexed = defaultdict(list)
+    for bill in db.bills.find({'state': state,
+                               'versions.document_id': {'$exists': True}},
+                              fields=['state', 'chamber', 'bill_id',
+                                      'title', 'versions']):
+        # versions of a bill with the same content share a Solr document
+        versions = defaultdict(list)
         for version in bill['versions']:
-            if 'document_id' not in version:
+            if version.get('document_id'):
+                versions[version['document_id']].append(version)
+
+        for document_id, doc_versions in versions.iteritems():
+            solr_id = '%s:%s' % (bill['_id'], document_id)
+            if solr_id not in indexed:
+                unindexed[document_id].append((solr_id, bill,
+                                               doc_versions))
+    return unindexed
+
+
+def _record_indexed(state, solr_ids):
+    if solr_ids:
+        now = datetime.datetime.utcnow()
+        for solr_id in solr_ids:
+            db.indexed_documents.save({'_id': solr_id, 'state': state,
+                                       'indexed_at': now}, safe=True)
+        del solr_ids[:]
+
+
+def _remove_unshared(state, updater):
+    """
+    Remove documents indexed before they could be shared by several
+    bills, when they were keyed by document_id alone.
+    """
+    old_ids = [doc['_id'] for doc in
+               db.indexed_documents.find({'state': state}, fields=['_id'])
+               if ':' not in doc['_id']]
+    if old_ids:
+        updater.delete(old_ids)
+        updater.commit()
+        db.indexed_documents.remove({'_id': {'$in': old_ids}}, safe=True)
+
+
+def import_versions(state, solr_url="http://localhost:8983/solr/",
+                    workers=None):
+    """
+    Index the text of a state's bill versions that haven't been indexed
+    yet, as one Solr document for each bill and stored document (whose
+    id is "<bill _id>:<document_id>"). Text is extracted by a pool of
+    workers processes (reusing any text already extracted from the same
+    documents) and sent to Solr in batches.
+
+    Documents whose text can't be extracted aren't indexed, and are
+    tried again on the next run.
+    """
+    updater = SolrUpdater(solr_url)
+    _remove_unshared(state, updater)
+
+    extractor = TextExtractor(settings.BILLY_EXTRACT_CACHE_DIR, workers)
+    uncommitted = []
+    count = 0
+
+    try:
+        # each document is read and extracted once for all of its bills
+        documents = extractor.extract_many(
+            _read_documents(_unindexed_documents(state)))
+        for (document_id, bills, content_type), text in documents:
+            if text is None:
+                logging.warning("No text extracted from %s" % document_id)
                 continue
 
-            doc = fs.get(version['document_id'])
+            for solr_id, bill, versions in bills:
+                updater.add(_solr_document(solr_id, bill, versions,
+                                           content_type, text))
+                uncommitted.append(solr_id)
+                count += 1
+
+            if len(uncommitted) >= BATCH_SIZE * COMMIT_EVERY:
+                updater.commit()
+                _record_indexed(state, uncommitted)
+    finally:
+        extractor.close()
 
-            params = {}
-            params['literal.bill_id'] = doc.metadata['bill']['bill_id']
-            params['literal.state'] = doc.metadata['bill']['state']
-            params['literal.chamber'] = doc.metadata['bill']['chamber']
-            params['literal.bill_title'] = (
-                doc.metadata['bill']['title'].encode('ascii', 'replace'))
-            params['literal.document_name'] = doc.metadata['name']
-            params['literal.url'] = doc.metadata['url']
-            params['literal.id'] = version['document_id']
-            params['commit'] = 'false'
+    updater.commit()
+    _record_indexed(state, uncommitted)
 
-            url = "%supdate/extract?%s" % (solr_url, urllib.urlencode(params))
-            req = urllib2.Request(url, {'file': doc})
-            urllib2.urlopen(req)
+    print 'indexed %s versions' % count
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         parents=[base_arg_parser],
-        description="Download and store copies of bill versions.")
+        description="Index the text of stored bill versions in Solr.")
+    parser.add_argument('state', type=str,
+                        help='the two-letter abbreviation of the state '
+                        'to index')
     parser.add_argument('-u', '--url', type=str, dest='url',
                         default='http://localhost:8983/solr/',
                         help='the solr instance URL')
+    parser.add_argument('--workers', type=int, dest='workers',
+                        help='number of processes to extract text with '
+                        '(default: BILLY_EXTRACT_WORKERS)')
 
     args = parser.parse_args()
 
+    settings.update(args)
+
     verbosity = {0: logging.WARNING,
                  1: logging.INFO}.get(args.verbose, logging.DEBUG)
 
@@ -55,4 +234,8 @@ if __name__ == '__main__':
                                 args.state + " %(message)s"),
                         datefmt="%H:%M:%S")
 
-    import_versions(args.state, args.url)
+    workers = args.workers
+    if workers is None:
+        workers = getattr(settings, 'BILLY_EXTRACT_WORKERS', None)
+
+    import_versions(args.state, args.url, workers)
@@ -1,3 +1,8 @@
+import re
+import zlib
+import calendar
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
 from billy import db, fs
 
 from django.http import HttpResponse, Http404
@@ -15,13 +20,158 @@ def data_zip(request, state):
         raise Http404
     return redirect(metadata['latest_dump_url'])
 
+def _parse_range(header, length):
+    """
+    Parse a single byte range Range header, returning the (start, end)
+    of the range (inclusive), None if there is no usable range or False
+    if the range can't be satisfied. Multiple ranges are ignored.
+    """
+    match = re.match(r'^bytes=(\d*)-(\d*)$', header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+
+    start, end = match.groups()
+    if not start:
+        # the last n bytes
+        start, end = max(length - int(end), 0), length - 1
+    else:
+        start = int(start)
+        end = min(int(end), length - 1) if end else length - 1
+
+    if start > end or start >= length:
+        return False
+    return start, end
+
+
+def _accepts_gzip(header):
+    """
+    Check whether an Accept-Encoding header allows gzip, taking q-values
+    into account (gzip;q=0 refuses it).
+    """
+    qualities = {}
+    for coding in header.split(','):
+        params = coding.split(';')
+        name = params[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+
+    for name in ('gzip', 'x-gzip', '*'):
+        if name in qualities:
+            return qualities[name] > 0
+    return False
+
+
+def _document_chunks(doc, start, end, decompress):
+    """
+    Yield bytes start to end (inclusive) of a GridFS file a chunk at a
+    time, after gunzipping the file if decompress is True.
+    """
+    if not decompress:
+        doc.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = doc.read(min(doc.chunk_size, remaining))
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+        return
+
+    # the decompressed position can't be seeked to, decompress from the
+    # start and throw away everything before it
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pos = 0
+    while pos <= end:
+        data = doc.read(doc.chunk_size)
+        data = (decompressor.decompress(data) if data else
+                decompressor.flush())
+        if not data:
+            return
+        if pos + len(data) > start:
+            yield data[max(start - pos, 0):end - pos + 1]
+        pos += len(data)
+
+
 def document(request, id):
     try:
         doc = fs.get(id)
     except gridfs.NoFile:
         raise Http404
 
-    return HttpResponse(doc.read(), mimetype=doc.content_type)
+    # compressed documents can be sent as they are if the client accepts
+    # gzip, otherwise they need to be decompressed first
+    compressed = getattr(doc, 'compression', None) == 'gzip'
+    decompress = compressed and not _accepts_gzip(request.META.get(
+        'HTTP_ACCEPT_ENCODING', ''))
+    if decompress:
+        length = doc.uncompressed_length
+        etag = '"%s-gunzip"' % doc.md5
+    else:
+        length = doc.length
+        etag = '"%s"' % doc.md5
+
+    last_modified = calendar.timegm(doc.upload_date.utctimetuple())
+    headers = {'ETag': etag,
+               'Last-Modified': formatdate(last_modified, usegmt=True),
+               'Accept-Ranges': 'bytes',
+               'Vary': 'Accept-Encoding'}
+    if compressed and not decompress:
+        headers['Content-Encoding'] = 'gzip'
+
+    # conditional requests
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_none_match is not None:
+        not_modified = (if_none_match.strip() == '*' or
+                        etag in [tag.strip() for tag in
+                                 if_none_match.split(',')])
+    elif if_modified_since is not None:
+        since = parsedate_tz(if_modified_since)
+        not_modified = since is not None and mktime_tz(since) >= last_modified
+    else:
+        not_modified = False
+
+    if not_modified:
+        response = HttpResponse(status=304)
+        for key, value in headers.iteritems():
+            response[key] = value
+        return response
+
+    byte_range = None
+    if 'HTTP_RANGE' in request.META:
+        # If-Range makes the range only apply to this version
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if (not if_range or
+            if_range.strip() in (etag, headers['Last-Modified'])):
+            byte_range = _parse_range(request.META['HTTP_RANGE'], length)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % length
+        return response
+    elif byte_range:
+        start, end = byte_range
+        response = HttpResponse(_document_chunks(doc, start, end, decompress),
+                                mimetype=doc.content_type, status=206)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, length)
+    else:
+        start, end = 0, length - 1
+        response = HttpResponse(_document_chunks(doc, start, end, decompress),
+                                mimetype=doc.content_type)
+
+    response['Content-Length'] = str(end - start + 1)
+    for key, value in headers.iteritems():
+        response[key] = value
+    return response
 
 
 def legislator_preview(request, id):
@@ -0,0 +1,104 @@
+import os
+import json
+import shutil
+import tempfile
+
+from nose.tools import with_setup
+
+from billy import db
+from billy.importers import bills
+
+
+def test_bill_fingerprint():
+    tmp = tempfile.mkdtemp()
+    try:
+        vote_path = os.path.join(tmp, 'vote.json')
+        with open(vote_path, 'w') as f:
+            f.write('{"motion": "passage"}')
+
+        fingerprint = bills.bill_fingerprint('{}', [vote_path], 'abc', 'c')
+        assert fingerprint == bills.bill_fingerprint('{}', [vote_path],
+                                                     'abc', 'c')
+
+        # the bill, its votes, the known names and committees all count
+        assert fingerprint != bills.bill_fingerprint('{ }', [vote_path],
+                                                     'abc', 'c')
+        assert fingerprint != bills.bill_fingerprint('{}', [], 'abc', 'c')
+        assert fingerprint != bills.bill_fingerprint('{}', [vote_path],
+                                                     'abd', 'c')
+        assert fingerprint != bills.bill_fingerprint('{}', [vote_path],
+                                                     'abc', 'd')
+
+        with open(vote_path, 'w') as f:
+            f.write('{"motion": "amendment"}')
+        assert fingerprint != bills.bill_fingerprint('{}', [vote_path],
+                                                     'abc', 'c')
+    finally:
+        shutil.rmtree(tmp)
+
+
+def _setup_db():
+    db.bills.drop()
+    db.metadata.drop()
+    db.legislators.drop()
+    db.metadata.insert({'_id': 'ex',
+                        'terms': [{'name': 'T1', 'sessions': ['S1']}]})
+
+
+@with_setup(_setup_db)
+def test_duplicate_bills_in_chunk():
+    tmp = tempfile.mkdtemp()
+    try:
+        paths = []
+        # both bill_ids are fixed up to 'HB 1'
+        for n, (bill_id, title) in enumerate((('HB1', 'An act'),
+                                              ('HB 1', 'An amended act'))):
+            path = os.path.join(tmp, '%s.json' % n)
+            with open(path, 'w') as f:
+                json.dump({'_type': 'bill', 'state': 'ex', 'session': 'S1',
+                           'chamber': 'lower', 'bill_id': bill_id,
+                           'title': title, 'sponsors': [], 'votes': [],
+                           'versions': [], 'actions': [],
+                           'documents': [], 'sources': []}, f)
+            paths.append(path)
+
+        count, skipped, keys = bills.import_bill_paths('ex', paths, {},
+                                                       {'S1': 'T1'})
+        assert (count, skipped) == (2, 0)
+
+        stored = list(db.bills.find({'state': 'ex'}))
+        assert len(stored) == 1
+        assert stored[0]['bill_id'] == 'HB 1'
+        assert stored[0]['title'] == 'An amended act'
+    finally:
+        shutil.rmtree(tmp)
+
+
+@with_setup(_setup_db)
+def test_populate_current_fields():
+    db.metadata.save({'_id': 'ex',
+                      'terms': [{'name': 'T1', 'sessions': ['S1']},
+                                {'name': 'T2', 'sessions': ['S2', 'S3']}]})
+    for n, session in enumerate(('S1', 'S2', 'S3')):
+        # flags left over from before S3 was the current session
+        db.bills.insert({'_id': 'EXB%08d' % n, 'state': 'ex',
+                         'session': session,
+                         '_current_session': session == 'S2',
+                         '_current_term': session != 'S3'})
+    db.bills.insert({'_id': 'EXB00000009', 'state': 'ex', 'session': 'S3'})
+    db.bills.insert({'_id': 'OTB00000001', 'state': 'ot', 'session': 'S1',
+                     '_current_session': True, '_current_term': True})
+
+    bills.populate_current_fields('ex')
+
+    flags = dict((bill['_id'], (bill['_current_session'],
+                                bill['_current_term']))
+                 for bill in db.bills.find({'state': 'ex'}))
+    assert flags == {'EXB00000000': (False, False),
+                     'EXB00000001': (False, True),
+                     'EXB00000002': (True, True),
+                     'EXB00000009': (True, True)}
+
+    # other states are left alone
+    other = db.bills.find_one('OTB00000001')
+    assert other['_current_session'] and other['_current_term']
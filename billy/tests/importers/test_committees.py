@@ -0,0 +1,19 @@
+from billy.importers.committees import CommitteeIndex
+
+
+def test_committee_index():
+    sub = {'_id': 'EXC000002', 'chamber': 'upper', 'committee': 'Finance',
+           'subcommittee': 'Taxes'}
+    parent = {'_id': 'EXC000001', 'chamber': 'upper', 'committee': 'Finance',
+              'subcommittee': None}
+    index = CommitteeIndex([sub, parent])
+
+    assert index.find('upper', 'Finance', 'Taxes') is sub
+    assert index.find('upper', 'Finance') is parent
+    assert index.find('upper', 'Finance', any_sub=True) is parent
+    assert index.find('lower', 'Finance') is None
+
+    # a name alone matches a subcommittee if there's no parent
+    index = CommitteeIndex([sub])
+    assert index.find('upper', 'Finance') is None
+    assert index.find('upper', 'Finance', any_sub=True) is sub
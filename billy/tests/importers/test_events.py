@@ -0,0 +1,40 @@
+import datetime
+
+from nose.tools import with_setup
+
+from billy import db
+from billy.importers.events import EventIndex
+
+
+def _event(id, description, **kwargs):
+    event = {'_id': id, 'state': 'ex', 'type': 'committee:meeting',
+             'when': datetime.datetime(2011, 5, 1, 10),
+             'description': description}
+    event.update(kwargs)
+    return event
+
+
+@with_setup(db.events.drop)
+def test_event_index():
+    db.events.insert(_event('EXE00000001', 'Finance', _guid='guid-1'))
+    db.events.insert(_event('EXE00000002', 'Judiciary',
+                            end=datetime.datetime(2011, 5, 1, 12)))
+    db.events.insert(_event('EXE00000003', 'Finance', state='ot'))
+
+    index = EventIndex('ex')
+
+    # by _guid, even if the rest of the event has changed
+    assert index.find(_event(None, 'Finance (moved)',
+                             _guid='guid-1')) == 'EXE00000001'
+
+    # by when, end, type and description otherwise
+    assert index.find(_event(None, 'Judiciary', _guid='guid-2',
+                             end=datetime.datetime(2011, 5, 1, 12))) == \
+        'EXE00000002'
+    assert index.find(_event(None, 'Judiciary')) is None
+    assert index.find(_event(None, 'Finance')) == 'EXE00000001'
+    assert index.find(_event(None, 'Appropriations')) is None
+
+    # events added while importing are found too
+    index.add(_event('EXE00000004', 'Appropriations'))
+    assert index.find(_event(None, 'Appropriations')) == 'EXE00000004'
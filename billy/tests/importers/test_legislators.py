@@ -143,6 +143,13 @@ def test_get_next_term():
     assert next_term == '2011-2012'
 
 
+@with_setup(setup_func)
+def test_get_adjacent_terms():
+    terms = legislators.get_adjacent_terms('ex')
+    assert terms == {'2009-2010': (None, '2011-2012'),
+                     '2011-2012': ('2009-2010', None)}
+
+
 @with_setup(setup_func)
 def test_import_legislator():
     leg1 = {'_type': 'person', 'state': 'ex',
@@ -1,12 +1,16 @@
+import datetime
+
 from nose.tools import with_setup
 
 from billy import db
+from billy.conf import settings
 from billy.importers import names
 
 
 def setup_func():
     db.legislators.drop()
     db.metadata.drop()
+    db.name_index.drop()
 
 
 @with_setup(setup_func)
@@ -34,3 +38,89 @@ def test_get_legislator_id():
     assert names.get_legislator_id('ex', 'S1',
                                    'upper', 'E. Iron Cloud') == 'EXL000042'
     assert not names.get_legislator_id('ex', 'S1', 'lower', 'Ed Iron Cloud')
+    assert names.get_legislator_ids('ex', 'S1', 'upper',
+                                    ['Iron Cloud', 'Nobody', 'Iron Cloud']
+                                   ) == ['EXL000042', None, 'EXL000042']
+
+
+@with_setup(setup_func)
+def test_name_index():
+    db.legislators.insert({'_id': 'EXL000001',
+                           'state': 'ex',
+                           'full_name': 'Michael J. Stephens',
+                           '_scraped_name': 'Michael J. Stephens',
+                           'first_name': 'Michael',
+                           'last_name': 'Stephens',
+                           'middle_name': 'Joseph',
+                           'updated_at': datetime.datetime.utcnow(),
+                           'roles': [{'type': 'member',
+                                      'state': 'ex',
+                                      'term': 'T1',
+                                      'chamber': 'upper',
+                                      'district': '1'}]})
+
+    names.build_name_index('ex', 'T1')
+    stored = db.name_index.find_one('ex-T1')
+    assert stored
+
+    matcher = names.get_name_matcher('ex', 'T1')
+    assert matcher.match('Stephens, M. J.', 'upper') == 'EXL000001'
+    assert matcher.match('Stephens', 'lower') is None
+    # loaded, not rebuilt
+    assert db.name_index.find_one('ex-T1')['built_at'] == stored['built_at']
+
+    # a changed legislator invalidates the index
+    db.legislators.update({'_id': 'EXL000001'},
+                          {'$set': {'updated_at': stored['built_at'] +
+                                    datetime.timedelta(seconds=1)}})
+    names.get_name_matcher('ex', 'T1')
+    assert db.name_index.find_one('ex-T1')['built_at'] > stored['built_at']
+
+
+@with_setup(setup_func)
+def test_fuzzy_match():
+    for id, first, last in (('EXL000001', 'Michael', 'Stephens'),
+                            ('EXL000002', 'Matthew', 'Stephenson'),
+                            ('EXL000003', 'Alice', 'Walker')):
+        db.legislators.insert({'_id': id, 'state': 'ex',
+                               'full_name': '%s %s' % (first, last),
+                               '_scraped_name': '%s %s' % (first, last),
+                               'first_name': first, 'last_name': last,
+                               'roles': [{'type': 'member', 'state': 'ex',
+                                          'term': 'T1', 'chamber': 'upper',
+                                          'district': id}]})
+
+    matcher = names.NameMatcher('ex', 'T1')
+    assert matcher.match('Stevens, Michael') is None
+
+    leg_id, score, form = matcher.fuzzy_match('Stevens, Michael')
+    assert leg_id == 'EXL000001'
+    assert form == 'stephens, michael'
+    assert matcher.fuzzy_match('Walker, Alce', 'upper')[0] == 'EXL000003'
+    assert matcher.fuzzy_match('Walker, Alce', 'lower') is None
+    assert matcher.fuzzy_match('Someone Else') is None
+
+
+@with_setup(setup_func)
+def test_fuzzy_match_ambiguous():
+    for id, first in (('EXL000001', 'Mark'), ('EXL000002', 'Michael')):
+        db.legislators.insert({'_id': id, 'state': 'ex',
+                               'full_name': '%s Stephens' % first,
+                               '_scraped_name': '%s Stephens' % first,
+                               'first_name': first, 'last_name': 'Stephens',
+                               'roles': [{'type': 'member', 'state': 'ex',
+                                          'term': 'T1', 'chamber': 'upper',
+                                          'district': id}]})
+
+    matcher = names.NameMatcher('ex', 'T1')
+    # both legislators score close to the best match
+    assert matcher.fuzzy_match('Stephens, M') is None
+    assert matcher.fuzzy_match('Stephens, M', margin=0)[0] == 'EXL000001'
+
+    # known forms shared by both legislators aren't fuzzy matched
+    old_threshold = getattr(settings, 'BILLY_FUZZY_MATCH_THRESHOLD', None)
+    settings.BILLY_FUZZY_MATCH_THRESHOLD = 0.9
+    try:
+        assert matcher.match('Stephens, M') is None
+    finally:
+        settings.BILLY_FUZZY_MATCH_THRESHOLD = old_threshold
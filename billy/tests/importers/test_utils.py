@@ -32,6 +32,36 @@ def test_insert_with_id():
     assert found['_all_ids'] == [id2]
 
 
+def _reset_legislator_ids():
+    db.legislators.drop()
+    db.legislator_ids.drop()
+    utils.__allocators.clear()
+
+
+@with_setup(_reset_legislator_ids)
+def test_insert_with_id_seed():
+    # IDs handed out before the counter existed aren't reused
+    db.legislators.insert({'_id': 'EXL000041', 'state': 'ex'})
+    obj = {'full_name': 'a test legislator', '_type': 'person',
+           'state': 'ex'}
+    assert utils.insert_with_id(obj) == 'EXL000042'
+
+
+@with_setup(_reset_legislator_ids)
+def test_assign_id():
+    objs = [{'full_name': 'legislator %s' % i, '_type': 'person',
+             'state': 'ex'} for i in xrange(2)]
+    ids = [utils.assign_id(obj) for obj in objs]
+    assert ids == ['EXL000001', 'EXL000002']
+    assert objs[0]['leg_id'] == objs[0]['_id'] == 'EXL000001'
+    assert objs[1]['_all_ids'] == ['EXL000002']
+
+    # nothing is inserted until the objects are
+    assert db.legislators.find_one() is None
+    db.legislators.insert(objs, safe=True)
+    assert db.legislators.find().count() == 2
+
+
 @with_setup(db.bills.drop)
 def test_update():
     dt = datetime.datetime.utcnow()
@@ -60,6 +90,22 @@ def test_update():
     assert obj2['field2'] == 'original'
 
 
+def test_update_unchanged_fields():
+    dt = datetime.datetime(2011, 1, 1)
+    obj = {'_type': 'bill', 'title': 'An act', 'sources': [],
+           '_content_hash': 'abc', 'updated_at': dt}
+
+    # a new fingerprint or sources are saved but don't count as a change
+    assert utils.update(obj, {'_type': 'bill', 'title': 'An act',
+                              'sources': [{'url': 'http://example.com'}],
+                              '_content_hash': 'abd'}, None)
+    assert obj['_content_hash'] == 'abd'
+    assert obj['updated_at'] == dt
+
+    assert utils.update(obj, {'title': 'An amended act'}, None)
+    assert obj['updated_at'] != dt
+
+
 def test_convert_timestamps():
     dt = datetime.datetime.now().replace(microsecond=0)
     ts = time.mktime(dt.utctimetuple())
@@ -133,3 +179,28 @@ def test_fix_bill_id():
         assert utils.fix_bill_id(bill_id) == expect
 
     assert utils.fix_bill_id('PR19-0041') == 'PR 19-0041'
+
+
+def test_chunks():
+    assert list(utils.chunks(xrange(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(utils.chunks([], 2)) == []
+
+
+@with_setup(db.test_ids.drop)
+def test_id_allocator():
+    ids1 = utils.IdAllocator('test_ids', 'ex', block_size=3)
+    assert [ids1.next() for i in xrange(4)] == [1, 2, 3, 4]
+    assert db.test_ids.find_one({'_id': 'ex'})['seq'] == 6
+
+    # unused IDs are given back if nobody reserved after them
+    ids1.release()
+    assert db.test_ids.find_one({'_id': 'ex'})['seq'] == 4
+
+    ids2 = utils.IdAllocator('test_ids', 'ex', block_size=3)
+    assert ids2.next() == 5
+    assert ids1.next() == 8
+
+    # but otherwise they are skipped
+    ids2.release()
+    assert db.test_ids.find_one({'_id': 'ex'})['seq'] == 10
+    assert ids2.next() == 11
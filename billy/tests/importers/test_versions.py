@@ -0,0 +1,48 @@
+import time
+import Queue
+
+from billy.importers.versions import TokenBucket, HostBuckets, _download
+
+
+def test_token_bucket():
+    bucket = TokenBucket(600)
+    start = time.time()
+    for i in xrange(4):
+        bucket.take()
+    # the first request is free, the rest are 0.1 seconds apart
+    assert 0.3 <= time.time() - start < 0.5
+
+
+def test_token_bucket_unlimited():
+    bucket = TokenBucket(0)
+    start = time.time()
+    for i in xrange(10):
+        bucket.take()
+    assert time.time() - start < 0.1
+
+
+def test_host_buckets():
+    buckets = HostBuckets(60)
+    start = time.time()
+    buckets.take('http://example.com/1')
+    buckets.take('http://example.org/1')
+    # different hosts don't wait on each other
+    assert time.time() - start < 0.1
+
+
+class FailingBuckets(object):
+    def take(self, url):
+        raise ValueError(url)
+
+
+def test_download_errors():
+    tasks = Queue.Queue()
+    results = Queue.Queue()
+    tasks.put(({'versions': [{'url': 'http://example.com/1'}]}, 0))
+    tasks.put(None)
+
+    _download(tasks, results, FailingBuckets())
+
+    # failed downloads are skipped but the downloader still finishes
+    assert results.get_nowait() is None
+    assert results.empty()
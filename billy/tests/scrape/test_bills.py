@@ -0,0 +1,117 @@
+import os
+import shutil
+import datetime
+import tempfile
+
+from nose.tools import with_setup
+
+from billy.bin.scrape import _scrape
+from billy.scrape.bills import BillScraper
+
+path = None
+
+
+def setup_func():
+    global path
+    path = tempfile.mkdtemp()
+    os.makedirs(os.path.join(path, 'bills'))
+
+
+def teardown_func():
+    shutil.rmtree(path)
+
+
+class ExampleBillScraper(BillScraper):
+    state = 'ex'
+
+    def __init__(self, *args, **kwargs):
+        self.unchanged = {}
+        self.fail = False
+        super(ExampleBillScraper, self).__init__(*args, **kwargs)
+
+    def scrape(self, chamber, session):
+        for bill_id, fingerprint in (('HB 1', {'status': 'passed'}),
+                                     ('HB 2', {'status': 'introduced'})):
+            self.unchanged[bill_id] = self.bill_unchanged(
+                chamber, session, bill_id, fingerprint)
+        if self.fail:
+            raise Exception('scrape failed')
+
+
+def _scraper():
+    return ExampleBillScraper({}, no_cache=True, output_dir=path,
+                              incremental_dir=path)
+
+
+def _save_bill_file(bill_id):
+    with open(os.path.join(path, 'bills', 'S1_lower_%s.json' % bill_id),
+              'w') as f:
+        f.write('{}')
+
+
+@with_setup(setup_func, teardown_func)
+def test_not_incremental():
+    scraper = ExampleBillScraper({}, no_cache=True, output_dir=path)
+    assert not scraper.bill_unchanged('lower', 'S1', 'HB 1', {})
+    assert scraper.updated_since('lower', 'S1') is None
+    scraper.save_watermark('lower', 'S1', datetime.datetime.utcnow())
+    assert not os.path.exists(os.path.join(path, 'incremental'))
+
+
+@with_setup(setup_func, teardown_func)
+def test_fingerprint_round_trip():
+    scraper = _scraper()
+    assert scraper.updated_since('lower', 'S1') is None
+
+    _scrape(scraper, 'bills', 'lower', 'S1')
+    assert scraper.unchanged == {'HB 1': False, 'HB 2': False}
+    _save_bill_file('HB 1')
+    _save_bill_file('HB 2')
+
+    # a new scraper reads back the fingerprints and watermark
+    scraper = _scraper()
+    updated = scraper.updated_since('lower', 'S1')
+    assert datetime.timedelta(0) <= (datetime.datetime.utcnow() -
+                                     updated) < datetime.timedelta(minutes=1)
+    _scrape(scraper, 'bills', 'lower', 'S1')
+    assert scraper.unchanged == {'HB 1': True, 'HB 2': True}
+
+    # other chambers and sessions are tracked separately
+    assert not scraper.bill_unchanged('upper', 'S1', 'HB 1',
+                                      {'status': 'passed'})
+    assert not scraper.bill_unchanged('lower', 'S2', 'HB 1',
+                                      {'status': 'passed'})
+
+    # a changed fingerprint means the bill has changed
+    assert not scraper.bill_unchanged('lower', 'S1', 'HB 1',
+                                      {'status': 'vetoed'})
+
+
+@with_setup(setup_func, teardown_func)
+def test_missing_bill_file():
+    _scrape(_scraper(), 'bills', 'lower', 'S1')
+    _save_bill_file('HB 1')
+
+    # HB 2 wasn't saved by the last run, so it can't be skipped
+    scraper = _scraper()
+    _scrape(scraper, 'bills', 'lower', 'S1')
+    assert scraper.unchanged == {'HB 1': True, 'HB 2': False}
+
+
+@with_setup(setup_func, teardown_func)
+def test_failed_scrape():
+    scraper = _scraper()
+    scraper.fail = True
+    try:
+        _scrape(scraper, 'bills', 'lower', 'S1')
+    except Exception:
+        pass
+    else:
+        assert False, 'scrape should have failed'
+    _save_bill_file('HB 1')
+
+    # fingerprints seen during a failed scrape aren't remembered
+    scraper = _scraper()
+    assert scraper.updated_since('lower', 'S1') is None
+    assert not scraper.bill_unchanged('lower', 'S1', 'HB 1',
+                                      {'status': 'passed'})
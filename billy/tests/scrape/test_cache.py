@@ -0,0 +1,152 @@
+import os
+import time
+import shutil
+import tempfile
+
+from nose.tools import with_setup
+
+from billy.scrape.cache import HashedCache
+
+path = None
+
+
+def setup_func():
+    global path
+    path = tempfile.mkdtemp()
+
+
+def teardown_func():
+    shutil.rmtree(path)
+
+
+def _count_bodies():
+    return sum(len(files) for root, dirs, files in
+               os.walk(os.path.join(path, 'objects')))
+
+
+@with_setup(setup_func, teardown_func)
+def test_get_set_delete():
+    cache = HashedCache(path)
+    assert cache.get('http://example.com/') is None
+
+    cache.set('http://example.com/', 'status: 200\r\n\r\nhello')
+    assert cache.get('http://example.com/') == 'status: 200\r\n\r\nhello'
+
+    cache.set('http://example.com/', 'status: 200\r\n\r\nchanged')
+    assert cache.get('http://example.com/') == 'status: 200\r\n\r\nchanged'
+    assert _count_bodies() == 1
+
+    cache.delete('http://example.com/')
+    assert cache.get('http://example.com/') is None
+    assert _count_bodies() == 0
+
+
+@with_setup(setup_func, teardown_func)
+def test_identical_bodies_stored_once():
+    cache = HashedCache(path)
+    cache.set('http://example.com/a', 'status: 200\r\ndate: 1\r\n\r\nsame')
+    cache.set('http://example.com/b', 'status: 200\r\ndate: 2\r\n\r\nsame')
+    assert _count_bodies() == 1
+    assert cache.get('http://example.com/a').endswith('date: 1\r\n\r\nsame')
+    assert cache.get('http://example.com/b').endswith('date: 2\r\n\r\nsame')
+
+    # body stays around while another entry refers to it
+    cache.delete('http://example.com/a')
+    assert _count_bodies() == 1
+    assert cache.get('http://example.com/b')
+
+
+@with_setup(setup_func, teardown_func)
+def test_ttl():
+    cache = HashedCache(path, ttl=0.1)
+    cache.set('http://example.com/', 'status: 200\r\n\r\nhello')
+    assert cache.get('http://example.com/')
+    time.sleep(0.2)
+    assert cache.get('http://example.com/') is None
+
+
+@with_setup(setup_func, teardown_func)
+def test_lru_eviction():
+    body = os.urandom(1000)
+    cache = HashedCache(path, max_size=2500)
+    cache.set('http://example.com/1', 'status: 200\r\n\r\n1' + body)
+    time.sleep(0.01)
+    cache.set('http://example.com/2', 'status: 200\r\n\r\n2' + body)
+    time.sleep(0.01)
+    # touch 1 so that 2 is the least recently used
+    assert cache.get('http://example.com/1')
+    time.sleep(0.01)
+    cache.set('http://example.com/3', 'status: 200\r\n\r\n3' + body)
+
+    assert cache.get('http://example.com/1')
+    assert cache.get('http://example.com/2') is None
+    assert cache.get('http://example.com/3')
+
+
+def _total(cache):
+    return cache.db.execute('SELECT size FROM total').fetchone()[0]
+
+
+def _stored_size(cache):
+    return cache.db.execute('SELECT SUM(size) FROM bodies').fetchone()[0]
+
+
+@with_setup(setup_func, teardown_func)
+def test_running_total():
+    cache = HashedCache(path, max_size=2500)
+    for i in xrange(5):
+        cache.set('http://example.com/%s' % i,
+                  'status: 200\r\n\r\n%s%s' % (i, os.urandom(1000)))
+        assert _total(cache) == _stored_size(cache)
+    assert _total(cache) <= 2500
+
+    cache.set('http://example.com/4', 'status: 200\r\n\r\nshort')
+    cache.delete('http://example.com/3')
+    assert _total(cache) == _stored_size(cache)
+
+    # caches from before the total was kept start from the stored size
+    cache.db.execute('DROP TABLE total')
+    cache = HashedCache(path, max_size=2500)
+    assert _total(cache) == _stored_size(cache)
+
+
+@with_setup(setup_func, teardown_func)
+def test_hits_not_written():
+    cache = HashedCache(path)
+    cache.set('http://example.com/', 'status: 200\r\n\r\nhello')
+    accessed = cache.db.execute('SELECT accessed FROM entries').fetchone()
+    time.sleep(0.01)
+    assert cache.get('http://example.com/')
+    assert cache.db.execute('SELECT accessed FROM entries').fetchone() == \
+        accessed
+
+
+@with_setup(setup_func, teardown_func)
+def test_evict_to_low_water():
+    body = os.urandom(1000)
+    cache = HashedCache(path, max_size=4200)
+    for i in xrange(5):
+        cache.set('http://example.com/%s' % i,
+                  'status: 200\r\n\r\n%s%s' % (i, body))
+        time.sleep(0.01)
+
+    # the two least recently used entries go, leaving room to spare
+    assert cache.get('http://example.com/0') is None
+    assert cache.get('http://example.com/1') is None
+    assert _total(cache) <= 4200 * 0.9
+    for i in xrange(2, 5):
+        assert cache.get('http://example.com/%s' % i)
+
+
+@with_setup(setup_func, teardown_func)
+def test_close_writes_access_times():
+    cache = HashedCache(path, max_size=10000)
+    cache.set('http://example.com/', 'status: 200\r\n\r\nhello')
+    time.sleep(0.01)
+    assert cache.get('http://example.com/')
+    accessed = cache._accessed['http://example.com/']
+
+    cache.close()
+    assert cache._accessed == {}
+    assert cache.db.execute('SELECT accessed FROM entries').fetchone() == \
+        (accessed,)
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import with_setup
+
+from billy.bin.scrape import _merge_unit_output
+
+path = None
+
+
+def setup_func():
+    global path
+    path = tempfile.mkdtemp()
+
+
+def teardown_func():
+    shutil.rmtree(path)
+
+
+def _write(unit, scraper_type, name, content):
+    dirname = os.path.join(path, unit, scraper_type)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(os.path.join(dirname, name), 'w') as f:
+        f.write(content)
+
+
+def _read(scraper_type):
+    dirname = os.path.join(path, 'out', scraper_type)
+    contents = {}
+    for name in os.listdir(dirname):
+        with open(os.path.join(dirname, name)) as f:
+            contents[name] = f.read()
+    return contents
+
+
+@with_setup(setup_func, teardown_func)
+def test_merge_unit_output():
+    for scraper_type in ('bills', 'votes'):
+        os.makedirs(os.path.join(path, 'out', scraper_type))
+        _write('0', scraper_type, 'S1_lower_HB 1.json', '0')
+        _write('1', scraper_type, 'S1_lower_HB 1.json', '1')
+        _write('1', scraper_type, 'S1_lower_HB 2.json', '1')
+        _write('2', scraper_type, 'S1_lower_HB 1.json', '2')
+
+        for unit in ('0', '1', '2'):
+            _merge_unit_output(os.path.join(path, unit),
+                               os.path.join(path, 'out'), scraper_type)
+
+    # later saves replace earlier ones, as in a serial run
+    assert _read('bills') == {'S1_lower_HB 1.json': '2',
+                              'S1_lower_HB 2.json': '1'}
+
+    # but every vote is kept
+    assert _read('votes') == {'S1_lower_HB 1.json': '0',
+                              'S1_lower_HB 1-1.json': '1',
+                              'S1_lower_HB 1-2.json': '2',
+                              'S1_lower_HB 2.json': '1'}
+    assert not os.listdir(os.path.join(path, '1', 'votes'))
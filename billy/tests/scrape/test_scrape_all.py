@@ -0,0 +1,32 @@
+import os
+import sys
+
+from billy.bin import scrape_all
+
+
+def _fake_run_scrape_unit(args):
+    if args == 'exit':
+        sys.exit(1)
+    elif args == 'die':
+        os._exit(3)
+    elif args == 'error':
+        raise ValueError('scrape failed')
+
+
+def test_run_units():
+    run_scrape_unit = scrape_all._run_scrape_unit
+    # units run in forked processes, which see the replaced function
+    scrape_all._run_scrape_unit = _fake_run_scrape_unit
+    try:
+        results = scrape_all.run_units([('a', 'ok'), ('a', 'die'),
+                                        ('b', 'error'), ('b', 'exit'),
+                                        ('c', 'ok')], 2, 1)
+    finally:
+        scrape_all._run_scrape_unit = run_scrape_unit
+
+    errors = [error for start, elapsed, error in results]
+    assert errors[0] is None
+    assert errors[1] == 'worker exited with code 3'
+    assert 'ValueError: scrape failed' in errors[2]
+    assert 'SystemExit' in errors[3]
+    assert errors[4] is None
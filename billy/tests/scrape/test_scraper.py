@@ -0,0 +1,177 @@
+import time
+import shutil
+import tempfile
+import threading
+import SocketServer
+import BaseHTTPServer
+
+import scrapelib
+from nose.tools import with_setup
+
+from billy.scrape import Scraper, HttpPool, _http_pool
+
+cache_path = None
+
+
+def setup_func():
+    global cache_path
+    cache_path = tempfile.mkdtemp()
+
+
+def teardown_func():
+    shutil.rmtree(cache_path)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ a local server that records the requests made to it """
+
+    # connections are kept alive, so each gets a thread of its own
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%s%s' % (self.server_port, path)
+
+    def __enter__(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        # close pooled connections so the handler threads finish
+        for idle in _http_pool._idle.values():
+            for http in idle:
+                for conn in http.connections.values():
+                    conn.close()
+        self.shutdown()
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(
+                (self.path, self.headers.get('if-none-match'),
+                 self.client_address[1]))
+
+        if self.path.startswith('/slow'):
+            time.sleep(0.1)
+
+        if self.path == '/missing':
+            self.send_response(404)
+            body = 'missing'
+        elif (self.path.startswith('/etag') and
+              self.headers.get('if-none-match') == '"v1"'):
+            self.send_response(304)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        else:
+            self.send_response(200)
+            body = 'page %s' % self.path
+            if self.path.startswith('/etag'):
+                self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ExampleScraper(Scraper):
+    state = 'ex'
+    scraper_type = 'examples'
+
+
+def _scraper(**kwargs):
+    kwargs.setdefault('no_cache', True)
+    return ExampleScraper({}, requests_per_minute=0, retry_attempts=0,
+                          **kwargs)
+
+
+def test_http_pool():
+    pool = HttpPool()
+    http = pool.checkout(None, 5)
+    assert pool.checkout(None, 5) is not http
+
+    # returned connections are handed out again, but only for the same
+    # cache and timeout
+    pool.checkin(None, 5, http)
+    assert pool.checkout(None, 10) is not http
+    assert pool.checkout(None, 5) is http
+    assert pool.checkout(None, 5) is not http
+
+
+def test_connections_reused():
+    with _Server() as server:
+        scraper = _scraper()
+        other = _scraper()
+        assert scraper.urlopen(server.url('/1')) == 'page /1'
+        assert scraper.urlopen(server.url('/2')) == 'page /2'
+        # another scraper in the process shares the pooled connection
+        assert other.urlopen(server.url('/3')) == 'page /3'
+
+    ports = set(port for path, etag, port in server.requests)
+    assert len(ports) == 1
+    assert scraper._local.http is None
+
+
+def test_urlopen_many():
+    with _Server() as server:
+        scraper = _scraper()
+        urls = [server.url('/%s' % n) for n in xrange(10)]
+        results = dict(scraper.urlopen_many(urls, workers=3))
+
+    assert sorted(results) == sorted(urls)
+    for url, result in results.iteritems():
+        assert result == 'page %s' % url[url.rindex('/'):]
+    assert len(server.requests) == 10
+
+
+def test_urlopen_many_error():
+    with _Server() as server:
+        scraper = _scraper()
+        urls = [server.url('/missing')] + [server.url('/slow/%s' % n)
+                                           for n in xrange(10)]
+        try:
+            list(scraper.urlopen_many(urls, workers=2))
+        except scrapelib.HTTPError as e:
+            assert e.response.code == 404
+        else:
+            assert False, 'urlopen_many should raise the 404'
+
+    # the remaining URLs were abandoned
+    assert len(server.requests) < len(urls)
+
+
+@with_setup(setup_func, teardown_func)
+def test_revalidate():
+    with _Server() as server:
+        def fetch(path, revalidate):
+            scraper = _scraper(no_cache=False, cache_dir=cache_path,
+                               use_cache_first=True, revalidate=revalidate)
+            return scraper.urlopen(server.url(path))
+
+        assert fetch('/etag', False) == 'page /etag'
+        assert fetch('/plain', False) == 'page /plain'
+        assert len(server.requests) == 2
+
+        # the cache is used as-is without revalidation
+        assert fetch('/etag', False) == 'page /etag'
+        assert len(server.requests) == 2
+
+        # pages with an ETag are revalidated and served from the cache on
+        # a 304, other pages still come straight from the cache
+        assert fetch('/etag', True) == 'page /etag'
+        assert fetch('/plain', True) == 'page /plain'
+
+    assert [(path, etag) for path, etag, port in server.requests] == [
+        ('/etag', None), ('/plain', None), ('/etag', '"v1"')]
@@ -0,0 +1,117 @@
+import threading
+import BaseHTTPServer
+
+from lxml import etree
+from nose.tools import with_setup
+
+from billy import db
+from billy.search.index_versions import (SolrUpdater, _solr_document,
+                                         _unindexed_documents)
+
+
+class _SolrStandIn(BaseHTTPServer.HTTPServer):
+    """ a local stand-in for Solr that records update requests """
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           _SolrHandler)
+        self.requests = []
+
+
+class _SolrHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, body))
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write('<response/>')
+
+    def log_message(self, *args):
+        pass
+
+
+def test_solr_updater():
+    server = _SolrStandIn()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        updater = SolrUpdater('http://127.0.0.1:%s/solr/' %
+                              server.server_port, batch_size=2)
+        updater.add({'id': 'EXD00000001', 'text': u'An act \x0c& more'})
+        assert server.requests == []
+
+        updater.add({'id': 'EXD00000002', 'document_name': ['a', 'b'],
+                     'text': None})
+        updater.add({'id': 'EXD00000003'})
+        updater.delete(['EXD00000004'])
+        updater.commit()
+    finally:
+        server.shutdown()
+
+    paths = [path for path, body in server.requests]
+    assert paths == ['/solr/update'] * 4
+
+    batch = etree.fromstring(server.requests[0][1])
+    docs = batch.findall('doc')
+    assert len(docs) == 2
+    assert [(f.get('name'), f.text) for f in docs[0]] == [
+        ('id', 'EXD00000001'), ('text', 'An act & more')]
+    assert [(f.get('name'), f.text) for f in docs[1]] == [
+        ('document_name', 'a'), ('document_name', 'b'),
+        ('id', 'EXD00000002')]
+
+    assert len(etree.fromstring(server.requests[1][1]).findall('doc')) == 1
+    assert server.requests[2][1] == '<delete><id>EXD00000004</id></delete>'
+    assert server.requests[3][1] == '<commit/>'
+
+
+def _bill(_id, bill_id, versions):
+    return {'_id': _id, 'state': 'ex', 'chamber': 'upper',
+            'bill_id': bill_id, 'title': 'An act about %s' % bill_id,
+            'versions': versions}
+
+
+def test_solr_document():
+    bill = _bill('EXB00000001', 'SB 1', [])
+    versions = [{'name': 'Introduced', 'url': 'http://example.com/1',
+                 'document_id': 'EXD00000001'},
+                {'name': 'Enrolled', 'url': 'http://example.com/2',
+                 'document_id': 'EXD00000001'}]
+    doc = _solr_document('EXB00000001:EXD00000001', bill, versions,
+                         'text/html', u'An act')
+    assert doc['bill_id'] == 'SB 1'
+    assert doc['bill_title'] == 'An act about SB 1'
+    assert doc['document_name'] == ['Introduced', 'Enrolled']
+    assert doc['url'] == 'http://example.com/1'
+
+
+def _drop():
+    db.bills.drop()
+    db.indexed_documents.drop()
+
+
+@with_setup(_drop)
+def test_unindexed_documents():
+    # the same document stored for the versions of two bills
+    db.bills.insert(_bill('EXB00000001', 'SB 1', [
+        {'name': 'Introduced', 'url': 'http://example.com/1',
+         'document_id': 'EXD00000001'}]))
+    db.bills.insert(_bill('EXB00000002', 'HB 2', [
+        {'name': 'Companion', 'url': 'http://example.com/2',
+         'document_id': 'EXD00000001'},
+        {'name': 'Amended', 'url': 'http://example.com/3',
+         'document_id': 'EXD00000002'},
+        {'name': 'Not downloaded', 'url': 'http://example.com/4'}]))
+    db.indexed_documents.insert({'_id': 'EXB00000002:EXD00000002',
+                                 'state': 'ex'})
+
+    unindexed = _unindexed_documents('ex')
+    assert unindexed.keys() == ['EXD00000001']
+    bills = sorted((solr_id, bill['bill_id'],
+                    [v['name'] for v in versions])
+                   for solr_id, bill, versions in unindexed['EXD00000001'])
+    assert bills == [('EXB00000001:EXD00000001', 'SB 1', ['Introduced']),
+                     ('EXB00000002:EXD00000001', 'HB 2', ['Companion'])]
+
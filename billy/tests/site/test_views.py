@@ -0,0 +1,124 @@
+import gzip
+import StringIO
+
+from nose.tools import with_setup
+
+from django.conf import settings as django_settings
+if not django_settings.configured:
+    django_settings.configure()
+from django.http import HttpRequest
+
+from billy import db, fs
+from billy.importers.utils import gzip_document
+from billy.site.api.views import document, _accepts_gzip, _parse_range
+
+DOC_ID = 'EXD00000001'
+TEXT = ''.join('line %03d of an act\n' % n for n in xrange(100))
+
+
+def setup_func():
+    db.documents.files.remove({'_id': DOC_ID}, safe=True)
+    db.documents.chunks.remove({'files_id': DOC_ID}, safe=True)
+    # small chunks so that responses span several of them
+    fs.put(gzip_document(TEXT), _id=DOC_ID, content_type='text/plain',
+           compression='gzip', uncompressed_length=len(TEXT),
+           chunkSize=256)
+
+
+def _get(**meta):
+    request = HttpRequest()
+    request.method = 'GET'
+    request.META = meta
+    return document(request, DOC_ID)
+
+
+def test_accepts_gzip():
+    assert _accepts_gzip('gzip, deflate')
+    assert _accepts_gzip('deflate, gzip;q=0.5')
+    assert _accepts_gzip('*')
+    assert not _accepts_gzip('')
+    assert not _accepts_gzip('deflate')
+    assert not _accepts_gzip('gzip;q=0')
+    assert not _accepts_gzip('*, gzip;q=0')
+
+
+def test_parse_range():
+    assert _parse_range('bytes=0-9', 100) == (0, 9)
+    assert _parse_range('bytes=90-', 100) == (90, 99)
+    assert _parse_range('bytes=-10', 100) == (90, 99)
+    assert _parse_range('bytes=90-200', 100) == (90, 99)
+    assert _parse_range('bytes=100-', 100) is False
+    assert _parse_range('bytes=0-1,5-6', 100) is None
+    assert _parse_range('lines=0-1', 100) is None
+
+
+@with_setup(setup_func)
+def test_full_response():
+    response = _get()
+    assert response.status_code == 200
+    assert response.content == TEXT
+    assert response['Content-Length'] == str(len(TEXT))
+    assert response['Accept-Ranges'] == 'bytes'
+    assert response['ETag'].endswith('-gunzip"')
+    assert not response.has_header('Content-Encoding')
+
+    # clients that accept gzip get the stored bytes
+    response = _get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+    assert response.status_code == 200
+    assert response['Content-Encoding'] == 'gzip'
+    content = response.content
+    assert response['Content-Length'] == str(len(content))
+    assert gzip.GzipFile(fileobj=StringIO.StringIO(content)).read() == TEXT
+
+    # unless they refuse it
+    response = _get(HTTP_ACCEPT_ENCODING='gzip;q=0')
+    assert response.content == TEXT
+
+
+@with_setup(setup_func)
+def test_range_response():
+    response = _get(HTTP_RANGE='bytes=500-1099')
+    assert response.status_code == 206
+    assert response.content == TEXT[500:1100]
+    assert response['Content-Length'] == '600'
+    assert response['Content-Range'] == 'bytes 500-1099/%d' % len(TEXT)
+
+    response = _get(HTTP_RANGE='bytes=-20')
+    assert response.status_code == 206
+    assert response.content == TEXT[-20:]
+
+    # a range for another version of the document is ignored
+    response = _get(HTTP_RANGE='bytes=500-1099', HTTP_IF_RANGE='"other"')
+    assert response.status_code == 200
+    assert response.content == TEXT
+
+
+@with_setup(setup_func)
+def test_unsatisfiable_range():
+    response = _get(HTTP_RANGE='bytes=%d-' % len(TEXT))
+    assert response.status_code == 416
+    assert response['Content-Range'] == 'bytes */%d' % len(TEXT)
+
+
+@with_setup(setup_func)
+def test_conditional_request():
+    response = _get()
+    etag = response['ETag']
+    last_modified = response['Last-Modified']
+
+    response = _get(HTTP_IF_NONE_MATCH='"other", %s' % etag)
+    assert response.status_code == 304
+    assert response['ETag'] == etag
+    assert not response.content
+
+    response = _get(HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert response.status_code == 304
+
+    response = _get(HTTP_IF_NONE_MATCH='"other"')
+    assert response.status_code == 200
+    assert response.content == TEXT
+
+    # the gzipped representation has a different ETag
+    response = _get(HTTP_IF_NONE_MATCH=etag,
+                    HTTP_ACCEPT_ENCODING='gzip')
+    assert response.status_code == 200
@@ -0,0 +1,63 @@
+import shutil
+import tempfile
+
+from nose.tools import with_setup
+
+from billy.extract import TextExtractor, extract_text
+
+path = None
+
+
+def setup_func():
+    global path
+    path = tempfile.mkdtemp()
+
+
+def teardown_func():
+    shutil.rmtree(path)
+
+
+def test_extract_text():
+    assert extract_text('<p>An <b>act</b></p>',
+                        'text/html; charset=utf-8') == 'An act'
+    assert extract_text('An act', 'text/plain') == 'An act'
+    assert extract_text('...', 'application/msword') is None
+
+
+@with_setup(setup_func, teardown_func)
+def test_extract_many():
+    extractor = TextExtractor(path, workers=2)
+    try:
+        docs = [(1, '<p>An <b>act</b></p>', 'text/html'),
+                (2, '...', 'application/msword'),
+                (3, 'An act', 'text/plain')]
+        assert list(extractor.extract_many(docs)) == [(1, 'An act'),
+                                                      (2, None),
+                                                      (3, 'An act')]
+    finally:
+        extractor.close()
+
+
+@with_setup(setup_func, teardown_func)
+def test_extract_cache():
+    extractor = TextExtractor(path, workers=0)
+    assert extractor.get_cached('<p>An act</p>', 'text/html') is None
+    assert extractor.extract('<p>An act</p>', 'text/html') == 'An act'
+    assert extractor.get_cached('<p>An act</p>', 'text/html') == 'An act'
+
+    # the same document is only extracted once, even by another extractor
+    key = extractor._key('<p>An act</p>', 'text/html')
+    extractor._set(key, u'cached text')
+    other = TextExtractor(path, workers=0)
+    assert other.extract('<p>An act</p>', 'text/html') == 'cached text'
+
+    # but how it is extracted depends on its type
+    assert other.extract('<p>An act</p>', 'text/plain') == '<p>An act</p>'
+
+
+@with_setup(setup_func, teardown_func)
+def test_extract_in_process():
+    # single documents don't start a pool
+    extractor = TextExtractor(path, workers=2)
+    assert extractor.extract('An act', 'text/plain') == 'An act'
+    assert extractor._pool is None
@@ -1,4 +1,5 @@
 import re
+import zlib
 import urllib
 import urlparse
 
@@ -77,3 +78,14 @@ def urlescape(url):
     path = urllib.quote(path, '/%')
     qs = urllib.quote_plus(qs, ':&=')
     return urlparse.urlunsplit((scheme, netloc, path, qs, anchor))
+
+
+def read_document(doc):
+    """
+    Read the contents of a document from GridFS, decompressing it if
+    it was stored compressed.
+    """
+    data = doc.read()
+    if getattr(doc, 'compression', None) == 'gzip':
+        data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    return data
@@ -8,13 +8,12 @@ from urlparse import urljoin, urlparse, urlunparse
 import re
 from urllib import urlencode
 import os, os.path
-import tempfile
-from urllib import urlretrieve
 
 import csv
 from util import get_soup
 
 from billy.scrape.votes import Vote
+from billy.extract import get_extractor
 
 EXPECTED_VOTE_CODES = ['Y','N','E','NV','A','P','-']
 DOCUMENT_TYPES = ['EO', 'HB', 'HJR', 'HJRCA', 'HR', 'JSR', 'SB', 'SJR', 'SJRCA', 'SR']
@@ -28,20 +27,19 @@ BASE_LEGISLATION_URL = "http://ilga.gov/legislation/default.asp"
 VOTE_ACTION_PATTERN = re.compile("^(.+)(\d{3})-(\d{3})-(\d{3}).*$")
 
 def get_pdf_content(path):
-    """Return the text content of the PDF at the given path. Requires the pdftotext application be reachable.  
-       If the given path begins with 'http' then the URL will be downloaded to a temp file.
-       TODO: Cache PDFs?
+    """Return the lines of text content of the PDF at the given path.  Requires the pdftotext application be reachable.
+       If the given path begins with 'http' then the URL will be downloaded first.
+       The text is cached by the content of the PDF, see billy.extract.
     """
     if path.startswith("http"):
-        f = tempfile.NamedTemporaryFile(suffix=".pdf")
-        urlretrieve(path,f.name)
-        path = f.name
-
-    error_code = os.system("pdftotext -enc UTF-8 -layout %s" % path)
-    if error_code:
-        raise Exception("Error %i attempting to convert %s" % (error_code,path))
-    txtpath = path[:-3] + "txt"
-    return open(txtpath).readlines()
+        data = urlopen(path).read()
+    else:
+        data = open(path, 'rb').read()
+
+    text = get_extractor().extract(data, 'application/pdf')
+    if text is None:
+        raise Exception("Error attempting to convert %s" % path)
+    return text.encode('utf-8').splitlines(True)
 
 def get_bill_pages(scraper, url=None,doc_types=None):
     if url is None: url = legislation_url()